@@ -8,28 +8,297 @@
 """
 
 # Import dependencies
+import calendar
+import collections
 import datetime
-import io
+import hashlib
 import os
+import queue
 import re
 import shutil
+import threading
 import time
 import traceback
-import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, render_template, url_for
-from flask import jsonify, request, redirect, send_file, send_from_directory
+from flask import Flask, Response, render_template, url_for
+from flask import g, request, redirect, send_from_directory
 
-from entree.projects import CLASSES, CLASS_LONG_NAMES
-from entree.utils import copy_file_structure, create_single_file, get_all_dirs_and_files, filemap
+from entree.archive import (
+    ARCHIVE_FORMATS,
+    ARCHIVE_MIMETYPES,
+    get_archive_etag,
+    get_reproducible_date,
+    stream_archive,
+)
+from entree.generation import get_plan_digest
+from entree.projects import CLASSES_BY_LONG_NAME, CLASS_LONG_NAMES
+from entree.utils import CACHES, LRUCache, filemap
 
 __version__ = "1.0"
 
 app = Flask(__name__)
+# Archive settings (see `entree.archive.stream_archive`)
+app.config.setdefault("ARCHIVE_FORMATS", ARCHIVE_FORMATS)
+app.config.setdefault("ARCHIVE_COMPRESSLEVEL", None)
+app.config.setdefault("ARCHIVE_MIN_SIZE", 0)
+# Number of threads compressing zip members (0 or 1: request thread only)
+app.config.setdefault("ARCHIVE_WORKERS", os.cpu_count() or 1)
+# Reproducible archives: the creation date is the start of the month and all
+# members get the same timestamp (ARCHIVE_TIMESTAMP, POSIX time, or the
+# creation date), so that identical requests get identical archives with the
+# same ETag
+app.config.setdefault("ARCHIVE_REPRODUCIBLE", True)
+app.config.setdefault("ARCHIVE_TIMESTAMP", None)
+# Archives are generated by a pool of GENERATION_WORKERS threads, with at most
+# GENERATION_QUEUE_DEPTH more requests waiting for a thread, for up to
+# GENERATION_QUEUE_TIMEOUT seconds. Beyond that, /submit answers 503 with a
+# Retry-After header (in seconds). These limits apply to each process: with
+# gunicorn's threaded workers (see Procfile), keep GENERATION_WORKERS +
+# GENERATION_QUEUE_DEPTH below the number of threads of a worker so that
+# downloads never hold all of them.
+app.config.setdefault("GENERATION_WORKERS", 2)
+app.config.setdefault("GENERATION_QUEUE_DEPTH", 2)
+app.config.setdefault("GENERATION_QUEUE_TIMEOUT", 10)
+app.config.setdefault("GENERATION_RETRY_AFTER", 5)
 
 FILEROOT, FILEBASE = os.path.split(__file__)
 FILES_TO_IGNORE = [".DS_Store"]
 
+# File structures returned by /filestructure, keyed by project type and name
+FILESTRUCTURE_CACHE_SIZE = 1024
+_FILESTRUCTURE_CACHE = LRUCache(FILESTRUCTURE_CACHE_SIZE, name="filestructure")
+
+# Number of chunks generated ahead of a client
+GENERATION_BUFFER_SIZE = 16
+
+_COMPRESSION_EXECUTOR = None
+_COMPRESSION_EXECUTOR_LOCK = threading.Lock()
+_GENERATION_EXECUTOR = None
+_GENERATION_SLOTS = None
+_GENERATION_LOCK = threading.Lock()
+_GENERATION_DONE = object()
+
+# Upper bounds (in seconds) of the buckets of the duration histograms
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Endpoints whose requests are counted and timed
+METRICS_ENDPOINTS = ("submit", "filestructure")
+# Phases of a generation: finding the template files, rendering them and
+# compressing them into the archive
+METRICS_PHASES = ("walk", "render", "compress")
+# Content type of the Prometheus text exposition format
+METRICS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_METRICS_LOCK = threading.Lock()
+_REQUEST_COUNTS = collections.Counter()
+_REQUEST_DURATIONS = {}
+_PHASE_DURATIONS = {}
+_FILESTRUCTURE_DURATIONS = {}
+_ARCHIVE_COUNTS = collections.Counter()
+_ARCHIVE_BYTES = collections.Counter()
+_GENERATIONS_IN_FLIGHT = 0
+
+
+class Histogram(object):
+    """Distribution of durations, with cumulative buckets as in Prometheus"""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        """Initialization
+
+        Keyword args:
+            buckets (tuple, default=METRICS_BUCKETS): sorted upper bounds
+                of the buckets
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Adds a value to the histogram"""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+def observe(histograms, key, value):
+    """Adds a value to the histogram `key` of `histograms`, creating it if
+    needed
+    """
+    with _METRICS_LOCK:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def get_compression_executor():
+    """Returns the thread pool shared by all requests to compress zip
+    members, or None if `ARCHIVE_WORKERS` is 0 or 1
+    """
+    global _COMPRESSION_EXECUTOR
+    workers = app.config["ARCHIVE_WORKERS"]
+    if workers <= 1:
+        return None
+    with _COMPRESSION_EXECUTOR_LOCK:
+        if _COMPRESSION_EXECUTOR is None:
+            _COMPRESSION_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="entree-compress")
+    return _COMPRESSION_EXECUTOR
+
+
+def get_generation_pool():
+    """Returns the thread pool generating archives and the semaphore
+    limiting the number of generations running or waiting for a thread
+    """
+    global _GENERATION_EXECUTOR, _GENERATION_SLOTS
+    with _GENERATION_LOCK:
+        if _GENERATION_EXECUTOR is None:
+            workers = max(app.config["GENERATION_WORKERS"], 1)
+            _GENERATION_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="entree-generate")
+            _GENERATION_SLOTS = threading.BoundedSemaphore(workers + app.config["GENERATION_QUEUE_DEPTH"])
+    return _GENERATION_EXECUTOR, _GENERATION_SLOTS
+
+
+def _count_generation(delta):
+    """Updates the number of generations in flight"""
+    global _GENERATIONS_IN_FLIGHT
+    with _METRICS_LOCK:
+        _GENERATIONS_IN_FLIGHT += delta
+
+
+def measure_generation(chunks, archive_format, timings):
+    """Yields the chunks of an archive and records its size and, once it is
+    complete, the time spent rendering and compressing it
+
+    Args:
+        chunks (generator): chunks of the archive
+        archive_format (str): archive format
+        timings (dict): timings filled by `entree.archive.stream_archive`
+    """
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        with _METRICS_LOCK:
+            _ARCHIVE_COUNTS[archive_format] += 1
+        for phase in ("render", "compress"):
+            observe(_PHASE_DURATIONS, phase, timings[phase])
+    finally:
+        chunks.close()
+        with _METRICS_LOCK:
+            _ARCHIVE_BYTES[archive_format] += size
+
+
+def _put(buffer, item, cancelled):
+    """Puts an item in a bounded queue, waiting for space unless the
+    generation was cancelled. Returns False if it was.
+    """
+    while not cancelled.is_set():
+        try:
+            buffer.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _generate(chunks, buffer, cancelled, slots):
+    """Runs on the generation pool: puts the chunks of an archive in
+    `buffer`, followed by _GENERATION_DONE or the exception raised
+    """
+    try:
+        # The request may have given up while waiting for a thread
+        if cancelled.is_set():
+            return
+        for chunk in chunks:
+            if not _put(buffer, chunk, cancelled):
+                return
+        _put(buffer, _GENERATION_DONE, cancelled)
+    except Exception as exc:
+        _put(buffer, exc, cancelled)
+    finally:
+        chunks.close()
+        slots.release()
+        _count_generation(-1)
+
+
+def _receive(buffer, cancelled):
+    """Yields the chunks put in `buffer` by `_generate`"""
+    try:
+        while True:
+            chunk = buffer.get()
+            if chunk is _GENERATION_DONE:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # Stops the generation if the client went away
+        cancelled.set()
+
+
+def generate_in_background(chunks):
+    """Generates an archive on the generation pool
+
+    Args:
+        chunks (generator): chunks of the archive (see
+            `entree.archive.stream_archive`)
+
+    Returns:
+        generator yielding the chunks as they are generated, or None if the
+        pool is saturated or if the first chunk is not ready within
+        GENERATION_QUEUE_TIMEOUT seconds. The first chunk is generated
+        before returning, so that errors in the first file are raised here.
+        `chunks` is closed by this function if the generation never starts,
+        and by the pool thread otherwise.
+    """
+    executor, slots = get_generation_pool()
+    if not slots.acquire(blocking=False):
+        chunks.close()
+        return None
+    buffer = queue.Queue(maxsize=GENERATION_BUFFER_SIZE)
+    cancelled = threading.Event()
+    _count_generation(1)
+    try:
+        future = executor.submit(_generate, chunks, buffer, cancelled, slots)
+    except Exception:
+        chunks.close()
+        slots.release()
+        _count_generation(-1)
+        raise
+
+    try:
+        first_chunk = buffer.get(timeout=app.config["GENERATION_QUEUE_TIMEOUT"])
+    except queue.Empty:
+        # A generation still waiting for a thread is dropped right away. One
+        # that is running may be executing `chunks`: it stops at its next
+        # chunk and cleans up in `_generate`.
+        cancelled.set()
+        if future.cancel():
+            chunks.close()
+            slots.release()
+            _count_generation(-1)
+        return None
+    if first_chunk is _GENERATION_DONE or isinstance(first_chunk, Exception):
+        cancelled.set()
+        if first_chunk is _GENERATION_DONE:
+            return iter(())
+        raise first_chunk
+    received = _receive(buffer, cancelled)
+
+    def stream():
+        try:
+            yield first_chunk
+            yield from received
+        finally:
+            received.close()
+            cancelled.set()
+
+    return stream()
+
 
 # Routes
 # Main route
@@ -39,72 +308,115 @@ def home():
     error = request.args.get("error", default="")
     # if error is None:
     #     error = ''
-    return render_template("index.html", project_types=CLASS_LONG_NAMES, error=error)
+    return render_template(
+        "index.html", project_types=CLASS_LONG_NAMES, archive_formats=app.config["ARCHIVE_FORMATS"], error=error
+    )
 
 
 # form submission route
-@app.route("/submit", methods=["POST"])
+@app.route("/submit", methods=["GET", "POST"])
 def submit():
     try:
-        accepted_fields = ["email", "name", "projectname", "projecttype", "url"]
-        fields = sorted(list(request.form.keys()))
+        # Form fields can also be sent as query parameters so that archives
+        # can be cached
+        form = request.form if request.method == "POST" else request.args
+        accepted_fields = ["email", "format", "name", "projectname", "projecttype", "url"]
+        fields = sorted(list(form.keys()))
         for field in fields:
             if field not in accepted_fields and not field.startswith("cb_"):
                 raise ValueError("Wrong fields in request")
 
         # Get data from form
         # Project name and type
-        modname = request.form["projectname"]
+        modname = form["projectname"]
 
         if not re.match("^[a-zA-Z][a-zA-Z0-9_]*$", modname):
             return redirect(url_for("home", error="Wrong format for " "project name"))
 
-        project_type = request.form["projecttype"]
-        if project_type not in CLASS_LONG_NAMES:
+        project_type = form["projecttype"]
+        if project_type not in CLASSES_BY_LONG_NAME:
             return redirect(url_for("home", error="Project type unsupported"))
 
+        archive_format = form.get("format", "zip")
+        if archive_format not in app.config["ARCHIVE_FORMATS"]:
+            return redirect(url_for("home", error="Archive format unsupported"))
+
         # Author information
         config = {}
-        config["author"] = request.form["name"]
+        config["author"] = form["name"]
 
-        if "@" in request.form["email"]:
-            emailsplit = request.form["email"].split("@")
+        if "@" in form["email"]:
+            emailsplit = form["email"].split("@")
         else:
             emailsplit = ["", ""]
 
         config["author_email_prefix"] = emailsplit[0]
         config["author_email_suffix"] = emailsplit[1]
 
-        config["author_url"] = request.form["url"]
+        config["author_url"] = form["url"]
 
         creation_date = datetime.datetime.now()
+        timestamp = None
+        if app.config["ARCHIVE_REPRODUCIBLE"]:
+            creation_date = get_reproducible_date(creation_date)
+            timestamp = app.config["ARCHIVE_TIMESTAMP"]
+            if timestamp is None:
+                timestamp = calendar.timegm(creation_date.timetuple())
 
         # Get the class corresponding to the given project type
-        project_cls = [class_ for class_ in CLASSES.values() if class_.project_long_name == project_type][0]
+        project_cls = CLASSES_BY_LONG_NAME[project_type]
 
         partial = [
-            os.path.join(project_cls.template_path(), tname[3:]) for tname in request.form if tname.startswith("cb_")
+            os.path.join(project_cls.template_path(), tname[3:]) for tname in form if tname.startswith("cb_")
         ]
 
-        # Create a zip file with the content
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, "w") as zipf:
-            # Copy entire file structure from template directory to the project
-            # directory
-            copy_file_structure(
-                ".",
-                project_cls.template_path(),
-                replace=project_cls.replace,
-                zipf=zipf,
-                files_to_ignore=FILES_TO_IGNORE,
-                partial=partial,
-                modname=modname,
-                config=config,
-                creation_date=creation_date,
+        start = time.perf_counter()
+        plan = project_cls.get_plan(partial=partial, files_to_ignore=FILES_TO_IGNORE)
+        walk_duration = time.perf_counter() - start
+        settings = {
+            "archive_format": archive_format,
+            "rootdir": ".",
+            "compresslevel": app.config["ARCHIVE_COMPRESSLEVEL"],
+            "min_size": app.config["ARCHIVE_MIN_SIZE"],
+            "timestamp": timestamp,
+        }
+        context = {"modname": modname, "config": config, "creation_date": creation_date}
+
+        # Reproducible archives are identified by their inputs, so cached
+        # copies can be validated without creating the archive
+        etag = None
+        if timestamp is not None:
+            etag = get_archive_etag(plan, **settings, **context)
+            if request.if_none_match.contains(etag):
+                if request.method in ("GET", "HEAD"):
+                    return Response(status=304, headers={"ETag": '"' + etag + '"'})
+                return Response(status=412)
+
+        # Stream an archive with the content, rendering each file on the
+        # generation pool as the archive is sent. Template errors in the
+        # first file still redirect to the home page.
+        timings = {}
+        chunks = stream_archive(plan, executor=get_compression_executor(), timings=timings, **settings, **context)
+        stream = generate_in_background(measure_generation(chunks, archive_format, timings))
+        if stream is None:
+            return Response(
+                "Too many downloads in progress, please try again later.",
+                status=503,
+                mimetype="text/plain",
+                headers={"Retry-After": str(app.config["GENERATION_RETRY_AFTER"])},
             )
+        # Only generations that run are timed, like the render and compress
+        # phases
+        observe(_PHASE_DURATIONS, "walk", walk_duration)
 
-        memory_file.seek(0)
-        return send_file(memory_file, download_name=modname + ".zip", as_attachment=True)
+        response = Response(
+            stream,
+            mimetype=ARCHIVE_MIMETYPES[archive_format],
+            headers={"Content-Disposition": "attachment; filename=" + modname + "." + archive_format},
+        )
+        if etag is not None:
+            response.set_etag(etag)
+        return response
     except:
         traceback.print_exc()
         return redirect(url_for("home", error="Oh no! Looks like " "there was a problem."))
@@ -114,25 +426,219 @@ def submit():
     # return redirect('/')
 
 
+@app.before_request
+def start_timer():
+    """Records the start time of each request"""
+    g.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """Counts and times the requests to METRICS_ENDPOINTS. Streamed
+    archives are timed until their first chunk is ready.
+    """
+    if request.endpoint in METRICS_ENDPOINTS and "start_time" in g:
+        with _METRICS_LOCK:
+            _REQUEST_COUNTS[(request.endpoint, request.method, str(response.status_code))] += 1
+        observe(_REQUEST_DURATIONS, request.endpoint, time.perf_counter() - g.start_time)
+    return response
+
+
+def _format_labels(labels):
+    """Formats Prometheus labels, e.g. '{endpoint="submit"}'"""
+    if not labels:
+        return ""
+    escaped = [
+        '{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    """Formats a sample value"""
+    if isinstance(value, float) and value != value:
+        return "NaN"
+    return repr(value)
+
+
+def _format_metric(lines, name, kind, description, samples):
+    """Appends a metric in the Prometheus text format to `lines`
+
+    Args:
+        lines (list): lines of the output
+        name (str): metric name
+        kind (str): "counter", "gauge" or "histogram"
+        description (str): help text
+        samples (list): list of (labels, value) where labels is a list of
+            (name, value) and value is a number or, for histograms, a
+            Histogram
+    """
+    lines.append("# HELP {0} {1}".format(name, description))
+    lines.append("# TYPE {0} {1}".format(name, kind))
+    for labels, value in samples:
+        if kind != "histogram":
+            lines.append(name + _format_labels(labels) + " " + _format_value(value))
+            continue
+        for bound, count in zip(value.buckets, value.counts):
+            lines.append(name + "_bucket" + _format_labels(labels + [("le", repr(float(bound)))]) + " " + repr(count))
+        lines.append(name + "_bucket" + _format_labels(labels + [("le", "+Inf")]) + " " + repr(value.count))
+        lines.append(name + "_sum" + _format_labels(labels) + " " + repr(value.sum))
+        lines.append(name + "_count" + _format_labels(labels) + " " + repr(value.count))
+
+
+def get_metrics():
+    """Returns the metrics of this process in the Prometheus text format"""
+    lines = []
+    with _METRICS_LOCK:
+        _format_metric(
+            lines,
+            "entree_requests_total",
+            "counter",
+            "Requests handled, by endpoint, method and status code.",
+            [
+                ([("endpoint", endpoint), ("method", method), ("status", status)], count)
+                for (endpoint, method, status), count in sorted(_REQUEST_COUNTS.items())
+            ],
+        )
+        _format_metric(
+            lines,
+            "entree_request_duration_seconds",
+            "histogram",
+            "Time to answer requests (to the first chunk for archives).",
+            [([("endpoint", endpoint)], _REQUEST_DURATIONS[endpoint]) for endpoint in sorted(_REQUEST_DURATIONS)],
+        )
+        _format_metric(
+            lines,
+            "entree_phase_duration_seconds",
+            "histogram",
+            "Time spent in each phase of a generation (walk, render, compress).",
+            [([("phase", phase)], _PHASE_DURATIONS[phase]) for phase in METRICS_PHASES if phase in _PHASE_DURATIONS],
+        )
+        _format_metric(
+            lines,
+            "entree_filestructure_build_seconds",
+            "histogram",
+            "Time to build uncached /filestructure responses, by project type.",
+            [
+                ([("project", project)], _FILESTRUCTURE_DURATIONS[project])
+                for project in sorted(_FILESTRUCTURE_DURATIONS)
+            ],
+        )
+        _format_metric(
+            lines,
+            "entree_archives_total",
+            "counter",
+            "Archives generated completely, by format.",
+            [([("format", fmt)], count) for fmt, count in sorted(_ARCHIVE_COUNTS.items())],
+        )
+        _format_metric(
+            lines,
+            "entree_archive_bytes_total",
+            "counter",
+            "Archive bytes produced, by format.",
+            [([("format", fmt)], count) for fmt, count in sorted(_ARCHIVE_BYTES.items())],
+        )
+        _format_metric(
+            lines,
+            "entree_generations_in_flight",
+            "gauge",
+            "Archive generations running or waiting for a worker.",
+            [([], _GENERATIONS_IN_FLIGHT)],
+        )
+    caches = sorted(CACHES.items())
+    _format_metric(
+        lines,
+        "entree_cache_hits_total",
+        "counter",
+        "Cache lookups that found a valid entry.",
+        [([("cache", name)], cache.hits) for name, cache in caches],
+    )
+    _format_metric(
+        lines,
+        "entree_cache_misses_total",
+        "counter",
+        "Cache lookups that found no valid entry.",
+        [([("cache", name)], cache.misses) for name, cache in caches],
+    )
+    _format_metric(
+        lines,
+        "entree_cache_hit_ratio",
+        "gauge",
+        "Fraction of the cache lookups that were hits.",
+        [
+            ([("cache", name)], cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else float("nan"))
+            for name, cache in caches
+        ],
+    )
+    _format_metric(
+        lines,
+        "entree_cache_entries",
+        "gauge",
+        "Entries in each cache.",
+        [([("cache", name)], len(cache)) for name, cache in caches],
+    )
+    return "\n".join(lines) + "\n"
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Returns the metrics of the app in the Prometheus text format"""
+    return Response(get_metrics(), content_type=METRICS_MIMETYPE)
+
+
 # form submission route
 @app.route("/filestructure/<project_type>", methods=["GET"])
 def filestructure(project_type="Python"):
     """Returns file structure for a given project type"""
-    if project_type not in CLASS_LONG_NAMES:
+    if project_type not in CLASSES_BY_LONG_NAME:
         return redirect(url_for("home", error="Project type unsupported"))
 
     modname = request.args.get("projectname", default="")
     if modname == "":
         modname = "src"
 
-    # Get the class corresponding to the given project type
-    project_cls = [class_ for class_ in CLASSES.values() if class_.project_long_name == project_type][0]
+    # The file structure only depends on the templates and the project name.
+    # Templates do not change while the app is running (build plans are
+    # cached the same way), so the response is computed once.
+    key = (project_type, modname)
+    cached = _FILESTRUCTURE_CACHE.get(key)
+    if cached is None:
+        start = time.perf_counter()
+        cached = get_file_structure(CLASSES_BY_LONG_NAME[project_type], modname)
+        observe(_FILESTRUCTURE_DURATIONS, project_type, time.perf_counter() - start)
+        _FILESTRUCTURE_CACHE.put(key, cached)
+    etag, body = cached
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": '"' + etag + '"'})
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+
+def get_file_structure(project_cls, modname):
+    """Returns the entity tag and JSON body of the /filestructure response
+    for a project
 
-    dirs, files = get_all_dirs_and_files(project_cls.template_path(), files_to_ignore=FILES_TO_IGNORE)
+    Args:
+        project_cls (class): project class
+        modname (str): project name
+
+    Returns:
+        tuple (etag, body)
+    """
+    plan = project_cls.get_plan(files_to_ignore=FILES_TO_IGNORE)
+    etag = hashlib.sha256((get_plan_digest(plan) + "\n" + modname).encode("utf-8")).hexdigest()
+
+    # The plan already lists the template directories and files, in the
+    # order of the template tree
+    template_path = project_cls.template_path()
+    dirs = [os.path.relpath(operation.src, template_path) for operation in plan if operation.action == "mkdir"]
+    files = [os.path.relpath(operation.src, template_path) for operation in plan if operation.action != "mkdir"]
     dirs = filemap(dirs, replace=project_cls.replace, modname=modname)
     files = filemap(files, replace=project_cls.replace, modname=modname)
-
-    return jsonify({"dirs": dirs, "files": files})
+    return etag, app.json.dumps({"dirs": dirs, "files": files}).encode("utf-8")
 
 
 if __name__ == "__main__":
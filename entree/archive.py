@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: entree.archive
+.. moduleauthor:: Julien Spronck
+.. created:: Oct 2026
+
+Module creating project archives on the fly
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import lzma
+import mmap
+import os
+import struct
+import tarfile
+import time
+import zipfile
+import zlib
+
+from entree.generation import get_context_digest, get_plan_digest, iter_build
+from entree.utils import LRUCache
+
+# Supported archive formats and their file extension
+ARCHIVE_FORMATS = ("zip", "tar", "tar.gz", "tar.xz")
+
+# MIME type of each archive format
+ARCHIVE_MIMETYPES = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+    "tar.gz": "application/gzip",
+    "tar.xz": "application/x-xz",
+}
+
+# Zip members with these extensions are stored without compression since
+# their content is already compressed
+INCOMPRESSIBLE_EXTENSIONS = (
+    ".7z",
+    ".bz2",
+    ".gif",
+    ".gz",
+    ".ico",
+    ".jpeg",
+    ".jpg",
+    ".png",
+    ".woff",
+    ".woff2",
+    ".xz",
+    ".zip",
+)
+
+# Earliest date that can be stored in a zip file (1980-01-01)
+ZIP_MIN_TIMESTAMP = 315532800
+# Version of the zip format needed to extract members (2.0: deflate)
+ZIP_VERSION = 20
+# Zip "version made by" host system of all members (Unix)
+ZIP_UNIX = 3
+# Zip general purpose flag of member names encoded in UTF-8
+ZIP_UTF8_FLAG = 0x800
+# Largest sizes, offsets and number of members of zip files without the
+# ZIP64 extensions
+ZIP_MAX_SIZE = 0xFFFFFFFF
+ZIP_MAX_MEMBERS = 0xFFFF
+
+# Maximum number of compressed static zip members kept in memory
+COMPRESSED_CACHE_SIZE = 256
+# Maximum size (in bytes) of the static zip members kept in memory
+COMPRESSED_CACHE_MAX_SIZE = 1024 * 1024
+# Maximum total size (in bytes) of the compressed members kept in memory
+COMPRESSED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Maximum number of zip members being compressed concurrently ahead of the
+# member being written (see `stream_archive`)
+ARCHIVE_WINDOW = 16
+# Zip members smaller than this (in bytes) are compressed on the calling
+# thread even when an executor is given
+PARALLEL_MIN_SIZE = 4096
+
+# Records of the zip file format: local file header, central directory file
+# header and end of central directory record
+_ZIP_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_ZIP_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_ZIP_END_RECORD = struct.Struct("<4s4H2LH")
+
+_COMPRESSED_CACHE = LRUCache(COMPRESSED_CACHE_SIZE, name="compressed", maxbytes=COMPRESSED_CACHE_MAX_BYTES)
+
+
+def compress_data(data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=None):
+    """Compresses data the way zip members are compressed.
+
+    Args:
+        data (bytes): uncompressed data
+
+    Keyword args:
+        compress_type (int, default=zipfile.ZIP_DEFLATED): ZIP_DEFLATED or
+            ZIP_STORED
+        compresslevel (int, default=None): deflate level (0 to 9)
+
+    Returns:
+        (compressed data, CRC-32 of the uncompressed data) tuple
+    """
+    if compress_type == zipfile.ZIP_DEFLATED:
+        level = zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel
+        # wbits=-15: raw deflate stream, as stored in zip files
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+    else:
+        compressed = bytes(data)
+    return compressed, zlib.crc32(data)
+
+
+def compress_member(src, length, compress_type=zipfile.ZIP_DEFLATED, compresslevel=None):
+    """Compresses the first `length` bytes of a file the way zip members
+    are compressed (see `compress_data`). Unless the file is larger than
+    COMPRESSED_CACHE_MAX_SIZE, the result is cached until the file changes,
+    so that static members are only compressed once.
+
+    Args:
+        src (str): source file name
+        length (int): number of bytes to compress
+
+    Keyword args:
+        compress_type (int, default=zipfile.ZIP_DEFLATED): ZIP_DEFLATED or
+            ZIP_STORED
+        compresslevel (int, default=None): deflate level (0 to 9)
+
+    Returns:
+        (compressed data, CRC-32 of the uncompressed data) tuple
+    """
+    key = (os.path.abspath(src), length, compress_type, compresslevel)
+    stat = os.stat(src)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cache = length <= COMPRESSED_CACHE_MAX_SIZE
+    if not cache:
+        # Map the file in memory so that its content is handed to zlib
+        # without being copied
+        with open(src, "rb") as fsrc, mmap.mmap(fsrc.fileno(), length, access=mmap.ACCESS_READ) as fmap:
+            with memoryview(fmap) as data:
+                return compress_data(data, compress_type, compresslevel)
+    member = _COMPRESSED_CACHE.get(key, stamp)
+    if member is None:
+        member = compress_data(read_member(src, length), compress_type, compresslevel)
+        _COMPRESSED_CACHE.put(key, member, stamp, size=len(member[0]))
+    return member
+
+
+def read_member(src, length):
+    """Returns the first `length` bytes of a file"""
+    with open(src, "rb") as fsrc:
+        return fsrc.read(length)
+
+
+def _submit(executor, size, func, *args):
+    """Runs `func(*args)` on `executor`, or right away if there is no
+    executor or if the member is too small to be worth a thread switch.
+
+    Returns:
+        concurrent.futures.Future
+    """
+    if executor is not None and size >= PARALLEL_MIN_SIZE:
+        return executor.submit(func, *args)
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+class StreamSink(io.RawIOBase):
+    """Write-only file object buffering the bytes written to it until they
+    are collected with `drain`. It cannot seek or tell, so archive writers
+    write each member in a single pass (e.g. zip members are compressed
+    before their header is written).
+    """
+
+    def __init__(self):
+        """Initialization"""
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self):
+        """Returns and forgets the bytes written since the last call"""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class _CompressedSink(io.RawIOBase):
+    """Write-only file object compressing the bytes written to it into
+    another file object. Closing it flushes the compressor but leaves the
+    other file object open.
+    """
+
+    def __init__(self, fileobj, compressor):
+        """Initialization
+
+        Args:
+            fileobj (file object): where the compressed bytes are written
+            compressor: zlib or lzma compressor object
+        """
+        super().__init__()
+        self._fileobj = fileobj
+        self._compressor = compressor
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._fileobj.write(self._compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._fileobj.write(self._compressor.flush())
+        super().close()
+
+
+class ZipWriter(object):
+    """Writes project files into a zip archive
+
+    Members smaller than `min_size` bytes, or whose extension is in
+    INCOMPRESSIBLE_EXTENSIONS, are stored without compression. Members are
+    compressed before being written, so their sizes and CRC-32 are known
+    when their local header is written: the archive is written in a single
+    pass, without data descriptors or seeking. All members are written the
+    same way, so the archive does not depend on how they were compressed
+    (e.g. with an executor).
+    """
+
+    def __init__(self, fileobj, compresslevel=None, min_size=0, timestamp=None):
+        """Initialization
+
+        Args:
+            fileobj (file object): where the archive is written
+
+        Keyword args:
+            compresslevel (int, default=None): deflate level (0 to 9).
+                Defaults to the zlib default level.
+            min_size (int, default=0): minimum size (in bytes) of the
+                members that are compressed
+            timestamp (int, default=None): modification time (UTC POSIX
+                timestamp) of all members. Defaults to the current local
+                time when each member is written.
+        """
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.min_size = min_size
+        self.date_time = None
+        if timestamp is not None:
+            self.date_time = time.gmtime(max(timestamp, ZIP_MIN_TIMESTAMP))[:6]
+        self.offset = 0
+        # Central directory headers of the members written so far
+        self.directory = []
+
+    def get_compress_type(self, name, size):
+        """Returns the compression method for a member"""
+        if size < self.min_size or name.lower().endswith(INCOMPRESSIBLE_EXTENSIONS):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def _emit(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def _dos_date_time(self):
+        """Returns the modification date and time of a member in MS-DOS
+        format
+        """
+        year, month, day, hour, minute, second = self.date_time or time.localtime(time.time())[:6]
+        return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+    def _write_compressed(self, name, compressed, crc, file_size):
+        """Writes a member that is already compressed (see `compress_data`
+        and `compress_member`)
+        """
+        compress_type = self.get_compress_type(name, file_size)
+        name = name.replace(os.sep, "/")
+        try:
+            encoded_name = name.encode("ascii")
+            flags = 0
+        except UnicodeEncodeError:
+            encoded_name = name.encode("utf-8")
+            flags = ZIP_UTF8_FLAG
+        if max(file_size, len(compressed), self.offset) > ZIP_MAX_SIZE or len(self.directory) >= ZIP_MAX_MEMBERS:
+            raise ValueError("Project too large for a zip archive")
+        date, dos_time = self._dos_date_time()
+        fields = (flags, compress_type, dos_time, date, crc, len(compressed), file_size, len(encoded_name))
+        # Same attributes whatever the platform: Unix, rw-r--r--
+        central_header = _ZIP_CENTRAL_HEADER.pack(
+            b"PK\x01\x02", ZIP_VERSION, ZIP_UNIX, ZIP_VERSION, 0, *fields, 0, 0, 0, 0, 0o644 << 16, self.offset
+        )
+        self.directory.append(central_header + encoded_name)
+        self._emit(_ZIP_LOCAL_HEADER.pack(b"PK\x03\x04", ZIP_VERSION, 0, *fields, 0) + encoded_name)
+        self._emit(compressed)
+
+    def add_dir(self, name):
+        """Adds a directory (directories are implied by the member names)"""
+
+    def add_file(self, name, content):
+        """Adds a file
+
+        Args:
+            name (str): member name
+            content (bytes): file content
+        """
+        self.write_submitted(*self.submit_file(name, content))
+
+    def add_copy(self, name, src, length):
+        """Adds the first `length` bytes of a file without decoding them.
+        Small files are compressed once and their compressed data reused
+        (see `compress_member`).
+
+        Args:
+            name (str): member name
+            src (str): source file name
+            length (int): number of bytes to copy
+        """
+        self.write_submitted(*self.submit_copy(name, src, length))
+
+    def submit_file(self, name, content, executor=None):
+        """Starts compressing a file, on `executor` if given. The member is
+        written by `write_submitted`, so members can be compressed
+        concurrently and still be written in order.
+
+        Args:
+            name (str): member name
+            content (bytes): file content
+
+        Keyword args:
+            executor (concurrent.futures.Executor, default=None)
+
+        Returns:
+            arguments for `write_submitted` (tuple)
+        """
+        compress_type = self.get_compress_type(name, len(content))
+        future = _submit(executor, len(content), compress_data, content, compress_type, self.compresslevel)
+        return name, len(content), future
+
+    def submit_copy(self, name, src, length, executor=None):
+        """Starts compressing the first `length` bytes of a file, on
+        `executor` if given (see `submit_file` and `compress_member`).
+
+        Args:
+            name (str): member name
+            src (str): source file name
+            length (int): number of bytes to copy
+
+        Keyword args:
+            executor (concurrent.futures.Executor, default=None)
+
+        Returns:
+            arguments for `write_submitted` (tuple)
+        """
+        compress_type = self.get_compress_type(name, length)
+        future = _submit(executor, length, compress_member, src, length, compress_type, self.compresslevel)
+        return name, length, future
+
+    def write_submitted(self, name, file_size, future):
+        """Writes a member once it is compressed (see `submit_file`)
+
+        Args:
+            name (str): member name
+            file_size (int): uncompressed size of the member
+            future (concurrent.futures.Future): compression result
+        """
+        compressed, crc = future.result()
+        self._write_compressed(name, compressed, crc, file_size)
+
+    def close(self):
+        """Writes the central directory"""
+        start = self.offset
+        for header in self.directory:
+            self._emit(header)
+        if start > ZIP_MAX_SIZE:
+            raise ValueError("Project too large for a zip archive")
+        count = len(self.directory)
+        self._emit(_ZIP_END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, self.offset - start, start, 0))
+
+
+class TarWriter(object):
+    """Writes project files into a tar archive, compressed as a whole with
+    gzip or xz
+    """
+
+    def __init__(self, fileobj, compression=None, compresslevel=None, timestamp=None):
+        """Initialization
+
+        Args:
+            fileobj (file object): where the archive is written
+
+        Keyword args:
+            compression (str, default=None): "gz", "xz" or None
+            compresslevel (int, default=None): compression level (0 to 9)
+            timestamp (int, default=None): modification time (POSIX
+                timestamp) of all members. Defaults to the current time
+                when each member is written.
+        """
+        self.timestamp = timestamp
+        self._sink = None
+        if compression == "gz":
+            level = zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel
+            # wbits=31: deflate with a gzip header and trailer
+            fileobj = self._sink = _CompressedSink(fileobj, zlib.compressobj(level, zlib.DEFLATED, 31))
+        elif compression == "xz":
+            preset = lzma.PRESET_DEFAULT if compresslevel is None else compresslevel
+            fileobj = self._sink = _CompressedSink(fileobj, lzma.LZMACompressor(preset=preset))
+        self.tarf = tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT)
+
+    def _info(self, name, size=0, directory=False):
+        info = tarfile.TarInfo(name)
+        info.mtime = int(time.time() if self.timestamp is None else self.timestamp)
+        if directory:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+        else:
+            info.size = size
+            info.mode = 0o644
+        return info
+
+    def add_dir(self, name):
+        """Adds a directory"""
+        self.tarf.addfile(self._info(name, directory=True))
+
+    def add_file(self, name, content):
+        """Adds a file
+
+        Args:
+            name (str): member name
+            content (bytes): file content
+        """
+        self.tarf.addfile(self._info(name, len(content)), io.BytesIO(content))
+
+    def add_copy(self, name, src, length):
+        """Adds the first `length` bytes of a file without decoding them
+
+        Args:
+            name (str): member name
+            src (str): source file name
+            length (int): number of bytes to copy
+        """
+        with open(src, "rb") as fsrc:
+            self.tarf.addfile(self._info(name, length), fsrc)
+
+    def close(self):
+        """Writes the end of the archive"""
+        self.tarf.close()
+        if self._sink is not None:
+            self._sink.close()
+
+
+def get_archive_writer(fileobj, archive_format="zip", compresslevel=None, min_size=0, timestamp=None):
+    """Returns an archive writer
+
+    Args:
+        fileobj (file object): where the archive is written
+
+    Keyword args:
+        archive_format (str, default="zip"): one of ARCHIVE_FORMATS
+        compresslevel (int, default=None): compression level (0 to 9)
+        min_size (int, default=0): minimum size (in bytes) of the zip members
+            that are compressed
+        timestamp (int, default=None): modification time (POSIX timestamp)
+            of all members. Defaults to the time each member is written.
+
+    Returns:
+        ZipWriter or TarWriter
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError("Unknown archive format: `{0}`".format(archive_format))
+    if compresslevel is not None and not 0 <= compresslevel <= 9:
+        raise ValueError("Compression level must be between 0 and 9")
+    if archive_format == "zip":
+        return ZipWriter(fileobj, compresslevel=compresslevel, min_size=min_size, timestamp=timestamp)
+    compression = archive_format[4:] or None
+    return TarWriter(fileobj, compression=compression, compresslevel=compresslevel, timestamp=timestamp)
+
+
+def stream_archive(
+    plan,
+    archive_format="zip",
+    rootdir="",
+    compresslevel=None,
+    min_size=0,
+    executor=None,
+    window=ARCHIVE_WINDOW,
+    timestamp=None,
+    timings=None,
+    **kwargs,
+):
+    """Creates an archive of a project and yields it in chunks, as each file
+    is rendered, without ever holding the whole archive in memory.
+
+    Members are written in plan order, which is sorted and does not depend
+    on the filesystem. With a `timestamp`, archives are reproducible: the
+    same plan and variables give the same bytes (see `get_archive_etag`).
+
+    Args:
+        plan (iterable): list or iterator of entree.generation.BuildOperation
+            (see `entree.generation.plan_file_structure`)
+
+    Keyword args:
+        archive_format (str, default="zip"): one of ARCHIVE_FORMATS
+        rootdir (str, default=""): directory prefixed to the member names
+        compresslevel (int, default=None): compression level (0 to 9)
+        min_size (int, default=0): minimum size (in bytes) of the zip members
+            that are compressed
+        executor (concurrent.futures.Executor, default=None): executor
+            compressing zip members concurrently while the next files are
+            rendered. Members are still written in order. Tar archives are
+            compressed as a single stream and ignore it.
+        window (int, default=ARCHIVE_WINDOW): maximum number of zip members
+            compressed ahead of the member being written
+        timestamp (int, default=None): modification time (POSIX timestamp)
+            of all members. Defaults to the time each member is written.
+        timings (dict, default=None): if given, the time (in seconds) spent
+            rendering the files and compressing and writing the members is
+            added to its "render" and "compress" entries
+        **kwargs: dictionary containing the variables for templating
+
+    Yields:
+        chunks of the archive (bytes)
+    """
+    if timings is None:
+        timings = {}
+    timings.setdefault("render", 0.0)
+    timings.setdefault("compress", 0.0)
+    sink = StreamSink()
+    writer = get_archive_writer(
+        sink, archive_format, compresslevel=compresslevel, min_size=min_size, timestamp=timestamp
+    )
+    parallel = executor is not None and isinstance(writer, ZipWriter)
+    pending = collections.deque()
+    operations = iter_build(plan, **kwargs)
+    while True:
+        start = time.perf_counter()
+        operation = next(operations, None)
+        now = time.perf_counter()
+        timings["render"] += now - start
+        if operation is None:
+            break
+        relpath, kind, payload = operation
+        start = now
+        name = os.path.join(rootdir, relpath)
+        if kind == "dir":
+            writer.add_dir(name)
+        elif parallel:
+            if kind == "copy":
+                pending.append(writer.submit_copy(name, *payload, executor=executor))
+            else:
+                pending.append(writer.submit_file(name, payload.encode("utf-8"), executor=executor))
+            while len(pending) >= window or (pending and pending[0][2].done()):
+                writer.write_submitted(*pending.popleft())
+        elif kind == "copy":
+            writer.add_copy(name, *payload)
+        else:
+            writer.add_file(name, payload.encode("utf-8"))
+        data = sink.drain()
+        timings["compress"] += time.perf_counter() - start
+        if data:
+            yield data
+    start = time.perf_counter()
+    while pending:
+        writer.write_submitted(*pending.popleft())
+    writer.close()
+    timings["compress"] += time.perf_counter() - start
+    yield sink.drain()
+
+
+def get_reproducible_date(date):
+    """Returns the creation date used in reproducible archives: the start of
+    the month of `date`, since templates only show the month and year. All
+    builds in the same month then get the same content.
+
+    Args:
+        date (datetime.datetime): the date
+
+    Returns:
+        datetime.datetime
+    """
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_archive_etag(plan, archive_format="zip", rootdir="", compresslevel=None, min_size=0, timestamp=None, **kwargs):
+    """Returns a strong entity tag for a reproducible archive (see
+    `stream_archive`), computed from its inputs without creating it: the
+    plan and template files, the templating variables and the archive
+    settings.
+
+    Args:
+        plan (iterable): list of entree.generation.BuildOperation
+
+    Keyword args:
+        same as `stream_archive`
+
+    Returns:
+        entity tag (str, without quotes)
+    """
+    settings = [archive_format, rootdir, compresslevel, min_size, timestamp]
+    digest = hashlib.sha256(get_plan_digest(plan).encode("utf-8"))
+    digest.update(get_context_digest(**kwargs).encode("utf-8"))
+    digest.update(json.dumps(settings).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def stream_zip(plan, rootdir="", **kwargs):
+    """Creates a zip archive of a project and yields it in chunks (see
+    `stream_archive`).
+
+    Args:
+        plan (iterable): list or iterator of entree.generation.BuildOperation
+            (see `entree.generation.plan_file_structure`)
+
+    Keyword args:
+        rootdir (str, default=""): directory prefixed to the member names
+        **kwargs: dictionary containing the variables for templating
+
+    Yields:
+        chunks of the zip archive (bytes)
+    """
+    return stream_archive(plan, archive_format="zip", rootdir=rootdir, **kwargs)
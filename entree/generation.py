@@ -0,0 +1,828 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: entree.generation
+.. moduleauthor:: Julien Spronck
+.. created:: Oct 2026
+
+Module planning and generating projects from their template directories:
+build plans, file creation, updates of generated projects and staged builds
+"""
+
+import collections
+import contextlib
+import fnmatch
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import time
+import zipfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from entree.utils import (
+    WRITE_CHUNK_SIZE,
+    create_general_file,
+    get_config_param,
+    get_manifest_entries,
+    get_name_template,
+    get_package_version,
+    get_template_digest,
+    get_verbatim_length,
+    hash_file,
+    open_new_file,
+    render_file_content,
+    render_template,
+    stream_template,
+)
+
+# Name of the file recording how the files of a generated project were
+# created (see `execute_plan` and `update_plan`)
+GENERATION_MANIFEST = ".entree_manifest.json"
+# Ways of materializing files copied verbatim (see `get_link_mode`)
+LINK_MODES = ("copy", "reflink", "hardlink")
+# ioctl request cloning a file on copy-on-write filesystems (Linux FICLONE)
+FICLONE = 0x40049409
+# Supported fsync policies for project builds (see `get_fsync_policy`)
+FSYNC_POLICIES = ("none", "build", "file")
+
+
+def copy_file_data(src_fd, dst_fd, length):
+    """Copies bytes from one file descriptor to another, inside the kernel
+    when possible (`os.copy_file_range`, then `os.sendfile`).
+
+    Args:
+        src_fd (int): file descriptor to read from (from its current position)
+        dst_fd (int): file descriptor to write to (at its current position)
+        length (int): number of bytes to copy
+    """
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < length:
+                sent = os.copy_file_range(src_fd, dst_fd, length - copied)
+                if not sent:
+                    break
+                copied += sent
+        except OSError:
+            pass
+    if copied < length and hasattr(os, "sendfile"):
+        try:
+            start = os.lseek(src_fd, 0, os.SEEK_CUR)
+            while copied < length:
+                sent = os.sendfile(dst_fd, src_fd, start + copied, length - copied)
+                if not sent:
+                    break
+                copied += sent
+            os.lseek(src_fd, start + copied, os.SEEK_SET)
+        except OSError:
+            pass
+    while copied < length:
+        data = os.read(src_fd, min(WRITE_CHUNK_SIZE, length - copied))
+        if not data:
+            break
+        os.write(dst_fd, data)
+        copied += len(data)
+
+
+def reflink_file(src_fd, dst_fd):
+    """Makes a file share the data blocks of another file on copy-on-write
+    filesystems (e.g. Btrfs, XFS), using the `FICLONE` ioctl.
+
+    Args:
+        src_fd (int): file descriptor of the source file
+        dst_fd (int): file descriptor of the (empty) destination file
+
+    Returns:
+        True if the file was cloned, False if cloning is not supported
+    """
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+
+def copy_verbatim_file(src, dst, length, zipf=None, fsync=False, link_mode="copy"):
+    """Copies the first `length` bytes of a file without decoding them.
+
+    Args:
+        src (str): source file name
+        dst (str): destination file name
+        length (int): number of bytes to copy
+
+    Keyword args:
+        zipf (zipfile.ZipFile, default=None)
+        fsync (bool, default=False): set to True to flush the file to disk
+            before returning
+        link_mode (str, default="copy"): set to "reflink" to clone the file
+            when the filesystem supports it, or to "hardlink" to link it
+            (then clone it, then copy it). Only whole files are cloned or
+            linked (see `get_link_mode`).
+    """
+    if zipf is None:
+        if link_mode == "hardlink" and os.stat(src).st_size == length:
+            try:
+                os.link(src, dst)
+                return
+            except FileExistsError:
+                raise IOError("File already exists. Will not overwrite")
+            except OSError:
+                pass
+        with open(src, "rb") as fsrc, open_new_file(dst) as fdst:
+            if (
+                link_mode == "copy"
+                or os.fstat(fsrc.fileno()).st_size != length
+                or not reflink_file(fsrc.fileno(), fdst.fileno())
+            ):
+                copy_file_data(fsrc.fileno(), fdst.fileno(), length)
+            if fsync:
+                os.fsync(fdst.fileno())
+    else:
+        data = zipfile.ZipInfo(dst)
+        data.date_time = time.localtime(time.time())[:6]
+        data.compress_type = zipfile.ZIP_DEFLATED
+        if not length:
+            zipf.writestr(data, b"")
+            return
+        # Map the file in memory so that its content is handed to zlib
+        # without being copied or decoded
+        with open(src, "rb") as fsrc, mmap.mmap(fsrc.fileno(), length, access=mmap.ACCESS_READ) as fmap:
+            with memoryview(fmap) as file_content:
+                zipf.writestr(data, file_content)
+
+
+def create_file_from_template(dst, template_path, zipf=None, stream=False, fsync=False, link_mode="copy", **kwargs):
+    """Creates a file from a template file. Files without any Jinja syntax
+    are copied byte for byte instead of being rendered.
+
+    Args:
+        dst (str): name of the file to create
+        template_path (str): the path for the template file
+
+    Keyword args:
+        zipf (zipfile.ZipFile, default=None)
+        stream (bool, default=False): set to True to render and write the
+            file in chunks instead of rendering it in memory first
+        fsync (bool, default=False): set to True to flush the file to disk
+            before returning
+        link_mode (str, default="copy"): how files copied verbatim are
+            materialized (see `copy_verbatim_file`)
+        **kwargs: dictionary containing the variables for templating
+
+    Returns:
+        SHA-256 hash of the content of the created file (hexadecimal digest)
+    """
+    length = get_verbatim_length(template_path)
+    if length is not None:
+        copy_verbatim_file(template_path, dst, length, zipf=zipf, fsync=fsync, link_mode=link_mode)
+        return get_template_digest(template_path, length=length)
+    if stream:
+        file_content = stream_template(template_path, **kwargs)
+    else:
+        file_content = render_template(template_path, **kwargs)
+    return create_general_file(dst, file_content, zipf=zipf, fsync=fsync)
+
+
+class IgnoreMatcher(object):
+    """Matches file names and relative paths against a list of
+    `files_to_ignore` patterns (fnmatch syntax) compiled into a single
+    regular expression.
+    """
+
+    def __init__(self, patterns):
+        """Initialization
+
+        Args:
+            patterns (list): list of file name or relative path patterns
+        """
+        self.patterns = tuple(patterns)
+        self._match = None
+        if self.patterns:
+            regex = "|".join(fnmatch.translate(os.path.normcase(pat)) for pat in self.patterns)
+            self._match = re.compile(regex).match
+
+    def matches(self, name, relpath):
+        """Returns True if a file should be ignored.
+
+        Args:
+            name (str): the file name
+            relpath (str): the path of the file relative to the template root
+        """
+        if self._match is None:
+            return False
+        return bool(self._match(os.path.normcase(name)) or self._match(os.path.normcase(relpath)))
+
+
+@functools.lru_cache(maxsize=64)
+def _get_ignore_matcher(patterns):
+    return IgnoreMatcher(patterns)
+
+
+def get_ignore_matcher(files_to_ignore):
+    """Returns the compiled matcher for a list of files to ignore. Matchers
+    are compiled once for each distinct list.
+
+    Args:
+        files_to_ignore (list or IgnoreMatcher): list of file names to ignore
+
+    Returns:
+        IgnoreMatcher
+    """
+    if isinstance(files_to_ignore, IgnoreMatcher):
+        return files_to_ignore
+    return _get_ignore_matcher(tuple(files_to_ignore or ()))
+
+
+class PartialSelection(object):
+    """Compiled list of paths for a partial build.
+
+    Paths can be exact paths or glob patterns (fnmatch syntax). A path is
+    selected if it is in the list or matches one of the patterns. The
+    selection also knows which directories can contain selected paths, so
+    that other directories are never listed.
+    """
+
+    def __init__(self, paths, template_root):
+        """Initialization
+
+        Args:
+            paths (list): list of paths for a partial build, joined with
+                the template root directory (e.g. as in
+                `ProjectBase.create_all`)
+            template_root (str): the path to the project template directory
+        """
+        self.paths = set()
+        self.prefixes = set()
+        patterns = []
+        for path in paths:
+            relpath = os.path.normpath(os.path.relpath(path, start=template_root))
+            if any(char in relpath for char in "*?["):
+                patterns.append(relpath)
+                continue
+            self.paths.add(relpath)
+            parent = os.path.dirname(relpath)
+            while parent and parent not in self.prefixes:
+                self.prefixes.add(parent)
+                parent = os.path.dirname(parent)
+        self.patterns = tuple(patterns)
+        self._match = None
+        if patterns:
+            self._match = re.compile("|".join(fnmatch.translate(os.path.normcase(pat)) for pat in patterns)).match
+        # Part of each pattern before the first wildcard: paths matching a
+        # pattern all start with it
+        self.pattern_prefixes = [re.split(r"[*?\[]", pattern, maxsplit=1)[0] for pattern in patterns]
+
+    def includes(self, relpath):
+        """Returns True if a path is selected
+
+        Args:
+            relpath (str): path relative to the template root directory
+        """
+        if relpath in self.paths:
+            return True
+        return self._match is not None and self._match(os.path.normcase(relpath)) is not None
+
+    def may_contain(self, relpath):
+        """Returns True if a directory can contain selected paths
+
+        Args:
+            relpath (str): path of the directory relative to the template
+                root directory
+        """
+        if relpath in self.prefixes:
+            return True
+        dirprefix = relpath + os.sep
+        return any(
+            prefix.startswith(dirprefix) or dirprefix.startswith(prefix) for prefix in self.pattern_prefixes
+        )
+
+
+# Entry of a template directory (see `walk_template_tree`)
+TemplateEntry = collections.namedtuple("TemplateEntry", ["src", "relpath", "name", "is_dir"])
+
+
+def walk_template_tree(
+    path, basename="", files_to_ignore=(), include=None, descend=None, verbose=False, use_manifest=True
+):
+    """Lazily walks through a template directory with `os.scandir`, without
+    recursion. Entries are sorted by name within each directory and
+    directories always come before their content.
+
+    Ignored directories and directories rejected by `include` or `descend`
+    are pruned: their content is never listed. Bundled project templates
+    are read from the template manifest instead of the disk when possible.
+
+    Args:
+        path (str): the directory to walk through
+
+    Keyword args:
+        basename (str, default=''): prefix for the relative paths
+        files_to_ignore (list or IgnoreMatcher, default=()): list of file
+            name or relative path patterns to ignore.
+        include (callable, default=None): function called with the path and
+            the relative path of each entry, returning False if the entry
+            should be skipped.
+        descend (callable, default=None): function called with the relative
+            path of each directory, returning False if its content should
+            not be listed.
+        verbose (bool, default=False): set to True to print ignored files
+        use_manifest (bool, default=True): set to False to always read the
+            disk
+
+    Yields:
+        TemplateEntry tuples
+    """
+    ignore = get_ignore_matcher(files_to_ignore)
+    manifest_entries = get_manifest_entries(path) if use_manifest else None
+    if manifest_entries is not None:
+        return _walk_manifest(manifest_entries, path, basename, ignore, include, descend, verbose)
+    return _walk_directory(path, basename, ignore, include, descend, verbose)
+
+
+def _walk_directory(path, basename, ignore, include, descend, verbose):
+    """Same as `walk_template_tree`, always reading the disk"""
+    stack = [(path, basename)]
+    while stack:
+        dirpath, dirbase = stack.pop()
+        with os.scandir(dirpath) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        subdirs = []
+        for entry in entries:
+            relpath = os.path.join(dirbase, entry.name)
+            if include is not None and not include(entry.path, relpath):
+                continue
+            if ignore.matches(entry.name, relpath):
+                # file path is in the list of files to ignore
+                if verbose:
+                    print("File ignored: `{0}`".format(entry.path))
+                continue
+            if entry.is_dir():
+                if descend is None or descend(relpath):
+                    subdirs.append((entry.path, relpath))
+                yield TemplateEntry(entry.path, relpath, entry.name, True)
+            elif entry.is_file():
+                yield TemplateEntry(entry.path, relpath, entry.name, False)
+        stack.extend(reversed(subdirs))
+
+
+def _walk_manifest(entries, path, basename, ignore, include, descend, verbose):
+    """Same as `walk_template_tree` for a directory listed in the template
+    manifest.
+    """
+    # Directories whose content is listed
+    listed = {""}
+    for manifest_entry in entries:
+        subpath = manifest_entry["path"].replace("/", os.sep)
+        if os.path.dirname(subpath) not in listed:
+            continue
+        src = os.path.join(path, subpath)
+        relpath = os.path.join(basename, subpath)
+        name = os.path.basename(subpath)
+        if include is not None and not include(src, relpath):
+            continue
+        if ignore.matches(name, relpath):
+            if verbose:
+                print("File ignored: `{0}`".format(src))
+            continue
+        is_dir = manifest_entry.get("dir", False)
+        if is_dir and (descend is None or descend(relpath)):
+            listed.add(subpath)
+        yield TemplateEntry(src, relpath, name, is_dir)
+
+
+# One step of a project build (see `plan_file_structure`):
+# - action (str): "mkdir", "render" or "copy"
+# - src (str): path of the template directory or file
+# - parent (int): index in the plan of the parent directory operation,
+#   -1 for the root directory
+# - name (str): output name, or Jinja pattern for the name if `templated`
+# - templated (bool): True if `name` needs to be rendered
+BuildOperation = collections.namedtuple("BuildOperation", ["action", "src", "parent", "name", "templated"])
+
+
+def iter_file_structure(path, replace=None, files_to_ignore=None, partial=None, template_root=None):
+    """Walks through the file structure and yields the operations needed to
+    reproduce it, one at a time (see `plan_file_structure`).
+
+    Args:
+        path (str): the path to walk through
+
+    Keyword args:
+        replace (dict, default=None): dictionary for file name replacement.
+            Keys are old file names and values are new file names.
+        files_to_ignore (list, default=None): list of file names to ignore.
+        partial (list or PartialSelection, default=None): list of paths or
+            glob patterns for a partial build. Only the paths in the lists
+            will be created.
+        template_root (str, default=None): the path to the project template
+        directory
+
+    Yields:
+        BuildOperation, parent directories before their content
+    """
+    if not files_to_ignore:
+        files_to_ignore = get_config_param("files_to_ignore", [])
+
+    if template_root is None:
+        template_root = path
+
+    basename = os.path.relpath(path, start=template_root)
+    if basename == os.curdir:
+        basename = ""
+
+    include = descend = None
+    if partial:
+        # Partial build: only files and dirs in the partial list
+        # will be created
+        if not isinstance(partial, PartialSelection):
+            partial = PartialSelection(partial, template_root)
+        include = lambda _, relpath: partial.includes(relpath)
+        descend = partial.may_contain
+
+    index = 0
+    parents = {basename: -1}
+    for entry in walk_template_tree(
+        path, basename=basename, files_to_ignore=files_to_ignore, include=include, descend=descend, verbose=True
+    ):
+        fname = entry.name
+        templated = False
+        if replace and fname in replace:
+            fname = replace[fname]
+            templated = True
+        elif fname.endswith("_py.template"):
+            fname = fname[:-12] + ".py"
+
+        parent = parents[os.path.dirname(entry.relpath)]
+        if entry.is_dir:
+            parents[entry.relpath] = index
+            yield BuildOperation("mkdir", entry.src, parent, fname, templated)
+        else:
+            action = "render" if get_verbatim_length(entry.src) is None else "copy"
+            yield BuildOperation(action, entry.src, parent, fname, templated)
+        index += 1
+
+
+def plan_file_structure(path, replace=None, files_to_ignore=None, partial=None, template_root=None):
+    """Walks through the file structure and lists all the operations needed
+    to reproduce it. The plan does not depend on the templating variables
+    and can be executed many times with `execute_plan`.
+
+    Args:
+        path (str): the path to walk through
+
+    Keyword args:
+        replace (dict, default=None): dictionary for file name replacement.
+            Keys are old file names and values are new file names.
+        files_to_ignore (list, default=None): list of file names to ignore.
+        partial (list or PartialSelection, default=None): list of paths or
+            glob patterns for a partial build. Only the paths in the lists
+            will be created.
+        template_root (str, default=None): the path to the project template
+        directory
+
+    Returns:
+        list of BuildOperation, parent directories before their content
+    """
+    return list(
+        iter_file_structure(
+            path, replace=replace, files_to_ignore=files_to_ignore, partial=partial, template_root=template_root
+        )
+    )
+
+
+def iter_plan_paths(plan, **kwargs):
+    """Resolves the output paths of all operations in a plan.
+
+    Args:
+        plan (iterable): list or iterator of BuildOperation
+
+    Keyword args:
+        **kwargs: dictionary containing the variables for templating
+
+    Yields:
+        (BuildOperation, output path relative to the project root) tuples
+    """
+    # Only directory paths are kept, for the operations they contain
+    dirs = {}
+    for index, operation in enumerate(plan):
+        name = operation.name
+        if operation.templated:
+            name = get_name_template(name).render(**kwargs)
+        if operation.parent >= 0:
+            name = os.path.join(dirs[operation.parent], name)
+        if operation.action == "mkdir":
+            dirs[index] = name
+        yield operation, name
+
+
+def iter_build(plan, stream=False, **kwargs):
+    """Resolves the output of all operations in a plan, one at a time, so
+    that the caller can write them anywhere (see `entree.projects.iter_project`).
+
+    Args:
+        plan (iterable): list or iterator of BuildOperation (see
+            `plan_file_structure` and `iter_file_structure`)
+
+    Keyword args:
+        stream (bool, default=False): set to True to get the content of the
+            rendered files as iterators of chunks (see `stream_template`)
+        **kwargs: dictionary containing the variables for templating
+
+    Yields:
+        (path relative to the project root, kind, payload) tuples where kind
+        is "dir" (payload is None), "file" (payload is the rendered content)
+        or "copy" (payload is a (source file, number of bytes) tuple for
+        files to copy verbatim, see `copy_verbatim_file`)
+    """
+    for operation, relpath in iter_plan_paths(plan, **kwargs):
+        if operation.action == "mkdir":
+            yield relpath, "dir", None
+            continue
+        length = get_verbatim_length(operation.src)
+        if length is not None:
+            yield relpath, "copy", (operation.src, length)
+        elif stream:
+            yield relpath, "file", stream_template(operation.src, **kwargs)
+        else:
+            yield relpath, "file", render_template(operation.src, **kwargs)
+
+
+def execute_plan(rootdir, plan, zipf=None, stream=False, manifest=None, fsync=False, link_mode="copy", **kwargs):
+    """Creates all directories and files listed in a plan.
+
+    Args:
+        rootdir (str): the root directory where the files will be created
+        plan (list): list of BuildOperation (see `plan_file_structure`)
+
+    Keyword args:
+        zipf (zipfile.ZipFile, default=None)
+        stream (bool, default=False): set to True to render and write files
+            in chunks instead of rendering them in memory first
+        manifest (dict, default=None): generation manifest (see
+            `read_generation_manifest`) where the created files are recorded
+        fsync (bool, default=False): set to True to flush each file to disk
+            as soon as it is written
+        link_mode (str, default="copy"): how files copied verbatim are
+            materialized (see `copy_verbatim_file`)
+        **kwargs: dictionary containing the variables for templating
+    """
+    if not os.path.exists(rootdir) and zipf is None:
+        raise IOError('Root directory not found: "' + rootdir + '"')
+
+    if manifest is not None:
+        context_digest = get_context_digest(**kwargs)
+
+    for operation, relpath in iter_plan_paths(plan, **kwargs):
+        dst = os.path.join(rootdir, relpath)
+        if operation.action == "mkdir":
+            if zipf is None:
+                os.makedirs(dst, exist_ok=True)
+        else:
+            # The digest is computed from the content written, without
+            # reading the file back
+            output = create_file_from_template(
+                dst, operation.src, zipf=zipf, stream=stream, fsync=fsync, link_mode=link_mode, **kwargs
+            )
+            if manifest is not None and zipf is None:
+                manifest["files"][relpath] = {
+                    "inputs": _get_inputs_digest(operation.src, context_digest, relpath),
+                    "output": output,
+                }
+
+
+def get_context_digest(**kwargs):
+    """Returns a SHA-256 hash of the templating variables"""
+    context = json.dumps(kwargs, sort_keys=True, default=str)
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+def get_plan_digest(plan):
+    """Returns a SHA-256 hash of a plan (see `plan_file_structure`),
+    including the content of its template files
+    """
+    digest = hashlib.sha256(get_package_version().encode("utf-8"))
+    for operation in plan:
+        template_digest = "" if operation.action == "mkdir" else get_template_digest(operation.src)
+        entry = [operation.action, operation.parent, operation.name, operation.templated, template_digest]
+        digest.update(json.dumps(entry).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _get_inputs_digest(template_path, context_digest, relpath):
+    """Returns a SHA-256 hash of everything a generated file depends on"""
+    inputs = "\n".join([get_template_digest(template_path), context_digest, relpath])
+    return hashlib.sha256(inputs.encode("utf-8")).hexdigest()
+
+
+def read_generation_manifest(rootdir):
+    """Reads the generation manifest of a generated project.
+
+    Args:
+        rootdir (str): the root directory of the generated project
+
+    Returns:
+        dict with the creation date of the project ("creation_date", ISO
+        format) and the input and output hashes of each generated file
+        ("files")
+    """
+    path = os.path.join(rootdir, GENERATION_MANIFEST)
+    manifest = {"creation_date": None, "files": {}}
+    if os.path.exists(path):
+        with open(path) as fil:
+            manifest.update(json.load(fil))
+    return manifest
+
+
+def write_generation_manifest(rootdir, manifest):
+    """Writes the generation manifest of a generated project.
+
+    Args:
+        rootdir (str): the root directory of the generated project
+        manifest (dict): the manifest (see `read_generation_manifest`)
+    """
+    path = os.path.join(rootdir, GENERATION_MANIFEST)
+    with open(path, "w") as fil:
+        json.dump(manifest, fil, indent=4, sort_keys=True)
+
+
+def update_plan(rootdir, plan, manifest, fsync=False, **kwargs):
+    """Updates an existing project so that it matches a plan. Only files
+    whose inputs (template, templating variables and path) changed since
+    they were recorded in the generation manifest are rewritten. Files
+    modified locally are never overwritten.
+
+    Args:
+        rootdir (str): the root directory of the generated project
+        plan (list): list of BuildOperation (see `plan_file_structure`)
+        manifest (dict): generation manifest of the project (see
+            `read_generation_manifest`), updated in place
+
+    Keyword args:
+        fsync (bool, default=False): set to True to flush each file to disk
+            as soon as it is written
+        **kwargs: dictionary containing the variables for templating
+
+    Returns:
+        list of the paths of the files that were written
+    """
+    if not os.path.exists(rootdir):
+        raise IOError('Root directory not found: "' + rootdir + '"')
+
+    context_digest = get_context_digest(**kwargs)
+    records = manifest["files"]
+    written = []
+    for operation, relpath in iter_plan_paths(plan, **kwargs):
+        dst = os.path.join(rootdir, relpath)
+        if operation.action == "mkdir":
+            if not os.path.exists(dst):
+                os.makedirs(dst)
+            continue
+        record = records.get(relpath)
+        inputs = _get_inputs_digest(operation.src, context_digest, relpath)
+        exists = os.path.exists(dst)
+        if exists and record and record["inputs"] == inputs:
+            continue
+        content = render_file_content(operation.src, **kwargs)
+        output = hashlib.sha256(content).hexdigest()
+        if exists:
+            current = hash_file(dst)
+            if current != output and (record is None or current != record["output"]):
+                print("File modified locally, not updated: `{0}`".format(dst))
+                continue
+        if not exists or current != output:
+            with open(dst, "wb") as fil:
+                fil.write(content)
+                if fsync:
+                    fil.flush()
+                    os.fsync(fil.fileno())
+            written.append(dst)
+            print("File updated: `{0}`".format(dst))
+        records[relpath] = {"inputs": inputs, "output": output}
+    return written
+
+
+def get_fsync_policy(policy=None):
+    """Gets the fsync policy for project builds: "none" (leave it to the
+    operating system), "build" (flush everything once the build is
+    complete) or "file" (flush each file as soon as it is written).
+
+    Keyword args:
+        policy (str, default=None): the policy. Defaults to the `fsync`
+            config parameter, or "none"
+
+    Returns:
+        policy (str)
+    """
+    if policy is None:
+        policy = get_config_param("fsync", "none")
+    if policy not in FSYNC_POLICIES:
+        raise ValueError("Unknown fsync policy: `{0}`".format(policy))
+    return policy
+
+
+def get_link_mode(link_mode=None):
+    """Gets the way files without any Jinja syntax are materialized in
+    project builds: "copy" (copy their content), "reflink" (share their data
+    blocks on copy-on-write filesystems, otherwise copy them) or "hardlink"
+    (link them to the template file, otherwise reflink or copy them).
+    Hard-linked files are the template files themselves, so they must not be
+    modified in place.
+
+    Keyword args:
+        link_mode (str, default=None): the link mode. Defaults to the
+            `link_mode` config parameter, or "copy"
+
+    Returns:
+        link mode (str)
+    """
+    if link_mode is None:
+        link_mode = get_config_param("link_mode", "copy")
+    if link_mode not in LINK_MODES:
+        raise ValueError("Unknown link mode: `{0}`".format(link_mode))
+    return link_mode
+
+
+def sync_tree(path):
+    """Flushes all files below a directory, and the directories themselves,
+    to disk. Nothing outside of `path` is flushed.
+
+    Args:
+        path (str): the directory
+    """
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            if os.path.islink(filepath):
+                continue
+            with open(filepath, "rb") as fil:
+                os.fsync(fil.fileno())
+        sync_directory(dirpath)
+
+
+def sync_directory(path):
+    """Flushes a directory entry (e.g. a rename) to disk, where supported"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def is_empty_directory(path):
+    """Returns True if `path` is a directory without any entries"""
+    if not os.path.isdir(path):
+        return False
+    with os.scandir(path) as entries:
+        return next(entries, None) is None
+
+
+@contextlib.contextmanager
+def staged_directory(dirname, fsync="none"):
+    """Context manager yielding a temporary directory next to `dirname`.
+    The temporary directory is renamed to `dirname` when the block
+    completes, and deleted if the block raises an exception, so that
+    `dirname` only ever appears complete. `dirname` must not exist or be
+    an empty directory.
+
+    Args:
+        dirname (str): the directory to create
+
+    Keyword args:
+        fsync (str, default="none"): fsync policy (see `get_fsync_policy`)
+
+    Yields:
+        path to the temporary directory (str)
+    """
+    parent = os.path.dirname(os.path.abspath(dirname))
+    if not os.path.exists(parent):
+        raise IOError('Root directory not found: "' + parent + '"')
+    if os.path.exists(dirname) and not is_empty_directory(dirname):
+        raise IOError("Directory already exists. Will not overwrite")
+    stagedir = os.path.join(parent, ".{0}.{1}".format(os.path.basename(dirname), os.urandom(4).hex()))
+    os.mkdir(stagedir)
+    try:
+        yield stagedir
+        if fsync == "build":
+            sync_tree(stagedir)
+        os.rename(stagedir, dirname)
+    except BaseException:
+        shutil.rmtree(stagedir, ignore_errors=True)
+        raise
+    if fsync != "none":
+        sync_directory(parent)
@@ -6,7 +6,7 @@
 Module for all projects
 '''
 
-from entree.projects.base import ProjectBase
+from entree.projects.base import ProjectBase, iter_project
 from entree.projects.flask import Flask
 from entree.projects.flask_large import FlaskLarge
 from entree.projects.html5 import HTML5
@@ -15,4 +15,5 @@ from entree.projects.sqlalchemy import SQLAlchemy
 
 CLASSES = ProjectBase.__subclasses__()
 CLASS_LONG_NAMES = sorted([pcls.project_long_name for pcls in CLASSES])
+CLASSES_BY_LONG_NAME = {pcls.project_long_name: pcls for pcls in CLASSES}
 CLASSES = {pcls.__name__.lower(): pcls for pcls in CLASSES}
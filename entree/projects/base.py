@@ -11,18 +11,32 @@ import getopt
 import os
 import sys
 
-from entree.utils import (
-    copy_file_structure,
-    create_dirs,
-    create_single_file,
-    read_config,
+from entree.archive import ARCHIVE_FORMATS, stream_archive
+from entree.generation import (
+    execute_plan,
+    get_fsync_policy,
+    get_link_mode,
+    iter_build,
+    iter_file_structure,
+    is_empty_directory,
+    plan_file_structure,
+    read_generation_manifest,
+    staged_directory,
+    sync_tree,
+    update_plan,
+    write_generation_manifest,
 )
+from entree.utils import LRUCache, create_dirs, create_single_file, get_config_param, get_project_config
 
 __version__ = "0.1"
 
 PROJECTS_PATH = os.path.split(__file__)[0]
 # Path to the template root directory (directory containing all templates)
 TEMPLATE_ROOT = os.path.join(PROJECTS_PATH, "templates")
+# Maximum number of build plans kept in memory
+PLAN_CACHE_SIZE = 64
+
+_PLAN_CACHE = LRUCache(PLAN_CACHE_SIZE, name="plan")
 
 
 class ProjectBase(object):
@@ -93,6 +107,12 @@ class ProjectBase(object):
         if cls.single_file:
             msg += "    -s, --single-file: creates a single file instead of\n"
             msg += "                       a complete package.\n\n"
+        msg += "    -z, --archive: creates an archive containing the project\n"
+        msg += "                   files instead of a project directory.\n"
+        msg += "                   Formats: {0}.\n\n".format(", ".join(ARCHIVE_FORMATS))
+        msg += "    -u, --update: updates the files of an existing project\n"
+        msg += "                  whose templates or configuration changed.\n"
+        msg += "                  Files modified locally are not updated.\n\n"
         msg += "    -v, --version: diplays the version number.\n\n"
 
         print(msg)
@@ -122,17 +142,64 @@ class ProjectBase(object):
 
     @classmethod
     def get_config(cls):
-        """Gets project-specific configuration"""
-        config = read_config()
-        if "project_config" not in config:
-            return config
-        if cls.__name__ not in config["project_config"]:
-            del config["project_config"]
-            return config
-        for key, value in config["project_config"][cls.__name__].items():
-            config[key] = value
-        del config["project_config"]
-        return config
+        """Gets project-specific configuration. The configuration is computed
+        once and reused until the config file changes (see
+        `entree.utils.get_project_config`).
+
+        Returns:
+            entree.utils.FrozenDict, immutable and hashable
+        """
+        return get_project_config(cls.__name__)
+
+    @classmethod
+    def get_partial_paths(cls, config, partial):
+        """Gets the template paths of a partial build
+
+        Args:
+            config (dict): project configuration (see `get_config`)
+            partial (str): name of the partial build, as defined in the
+                config file
+
+        Returns:
+            list of paths, or None if `partial` is empty
+        """
+        if not partial:
+            return None
+        if "partial_builds" not in config:
+            raise ValueError("No `partial_builds` config parameter for " "this project type")
+        if partial not in config["partial_builds"]:
+            raise ValueError("Unknown partial build name: " "`{0}`".format(partial))
+        return [os.path.join(cls.template_path(), path) for path in config["partial_builds"][partial]]
+
+    @classmethod
+    def _plan_key(cls, partial, files_to_ignore):
+        """Key of a build plan in the plan cache"""
+        return (cls, tuple(sorted(partial or ())), tuple(files_to_ignore))
+
+    @classmethod
+    def get_plan(cls, partial=None, files_to_ignore=None):
+        """Gets the build plan for this project (see
+        `entree.generation.plan_file_structure`). Plans are computed once for
+        each combination of partial build and files to ignore.
+
+        Keyword args:
+            partial (list, default=None): list of paths for a partial build.
+            files_to_ignore (list, default=None): list of file names to
+                ignore. Defaults to the `files_to_ignore` config parameter.
+
+        Returns:
+            list of entree.generation.BuildOperation
+        """
+        if not files_to_ignore:
+            files_to_ignore = get_config_param("files_to_ignore", [])
+        key = cls._plan_key(partial, files_to_ignore)
+        plan = _PLAN_CACHE.get(key)
+        if plan is None:
+            plan = plan_file_structure(
+                cls.template_path(), replace=cls.replace, files_to_ignore=files_to_ignore, partial=partial
+            )
+            _PLAN_CACHE.put(key, plan)
+        return plan
 
     @classmethod
     def create_one(cls, rootdir, filename):
@@ -152,8 +219,11 @@ class ProjectBase(object):
             )
 
     @classmethod
-    def create_all(cls, rootdir, modname, partial=None, add_to_existing=False):
-        """Creates all project files and directories
+    def create_all(
+        cls, rootdir, modname, partial=None, add_to_existing=False, update=False, fsync=None, link_mode=None
+    ):
+        """Creates all project files and directories. New projects are built
+        in a temporary directory that is renamed into place once complete.
 
         Args:
             rootdir (str): the root directory
@@ -166,42 +236,123 @@ class ProjectBase(object):
             add_to_existing (bool, default=False): True if you want to add
                 files without creating a project directory (add to existing
                 project)
+            update (bool, default=False): True if you want to update the
+                files of an existing project instead of creating them (see
+                `entree.generation.update_plan`)
+            fsync (str, default=None): fsync policy, "none", "build" or
+                "file". Defaults to the `fsync` config parameter (see
+                `entree.generation.get_fsync_policy`)
+            link_mode (str, default=None): how files without any templating
+                are materialized, "copy", "reflink" or "hardlink". Defaults
+                to the `link_mode` config parameter (see
+                `entree.generation.get_link_mode`)
         """
+        # Read config file (project-specific settings override the fsync
+        # policy and link mode from the general configuration)
+        config = cls.get_config()
+        fsync = get_fsync_policy(config.get("fsync", "none") if fsync is None else fsync)
+        link_mode = get_link_mode(config.get("link_mode", "copy") if link_mode is None else link_mode)
         if add_to_existing:
             projectdir = rootdir
         else:
-            # Create project directory
             projectdir = os.path.join(rootdir, modname)
+        staged = not add_to_existing and not update and (
+            not os.path.exists(projectdir) or is_empty_directory(projectdir)
+        )
+        if not staged and not update:
             create_dirs(rootdir, projectdir)
+        manifest = read_generation_manifest(projectdir)
 
-        # Read config file and set creation_date
-        config = cls.get_config()
-        creation_date = datetime.datetime.now()
-
-        if partial:
-            if "partial_builds" not in config:
-                raise ValueError("No `partial_builds` config parameter for " "this project type")
-            if partial not in config["partial_builds"]:
-                raise ValueError("Unknown partial build name: " "`{0}`".format(partial))
-            partial = config["partial_builds"][partial]
-            partial = [os.path.join(cls.template_path(), path) for path in partial]
+        # Set creation_date (kept from the original generation when updating
+        # so that it does not trigger rewrites)
+        if update and manifest["creation_date"]:
+            creation_date = datetime.datetime.fromisoformat(manifest["creation_date"])
+        else:
+            creation_date = datetime.datetime.now()
 
-        files_to_ignore = []
-        if "files_to_ignore" in config:
-            files_to_ignore = config["files_to_ignore"]
+        partial = cls.get_partial_paths(config, partial)
+        files_to_ignore = config.get("files_to_ignore", [])
 
         # Copy entire file structure from template directory to the project
         # directory
-        copy_file_structure(
-            projectdir,
-            cls.template_path(),
-            replace=cls.replace,
-            partial=partial,
-            files_to_ignore=files_to_ignore,
-            modname=modname,
-            config=config,
-            creation_date=creation_date,
-        )
+        plan = cls.get_plan(partial=partial, files_to_ignore=files_to_ignore)
+        context = {"modname": modname, "config": config, "creation_date": creation_date}
+        manifest["creation_date"] = creation_date.isoformat()
+        if staged:
+            with staged_directory(projectdir, fsync=fsync) as stagedir:
+                execute_plan(
+                    stagedir, plan, manifest=manifest, fsync=fsync == "file", link_mode=link_mode, **context
+                )
+                write_generation_manifest(stagedir, manifest)
+            return
+        if update:
+            update_plan(projectdir, plan, manifest, fsync=fsync == "file", **context)
+        else:
+            execute_plan(projectdir, plan, manifest=manifest, fsync=fsync == "file", link_mode=link_mode, **context)
+        write_generation_manifest(projectdir, manifest)
+        if fsync == "build":
+            sync_tree(projectdir)
+
+    @classmethod
+    def create_archive(
+        cls, rootdir, modname, partial=None, archive_format="zip", compresslevel=None, min_size=None
+    ):
+        """Creates an archive (e.g. `<modname>.zip`) containing all project
+        files instead of a project directory
+
+        Args:
+            rootdir (str): the directory where the archive is created
+            modname (str): the module name
+
+        Keyword args:
+            partial (str, default=None): name of the partial build that you
+                want to use. Partial build names are defined in the config
+                file
+            archive_format (str, default="zip"): one of
+                `entree.archive.ARCHIVE_FORMATS`
+            compresslevel (int, default=None): compression level (0 to 9).
+                Defaults to the `compression_level` config parameter
+            min_size (int, default=None): minimum size (in bytes) of the zip
+                members that are compressed. Defaults to the
+                `compression_min_size` config parameter, or 0
+
+        Returns:
+            path to the archive (str)
+        """
+        if not os.path.exists(rootdir):
+            raise IOError('Root directory not found: "' + rootdir + '"')
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError("Unknown archive format: `{0}`".format(archive_format))
+        config = cls.get_config()
+        if compresslevel is None:
+            compresslevel = config.get("compression_level")
+        if min_size is None:
+            min_size = config.get("compression_min_size", 0)
+        partial = cls.get_partial_paths(config, partial)
+        plan = cls.get_plan(partial=partial, files_to_ignore=config.get("files_to_ignore", []))
+
+        filename = os.path.join(rootdir, modname + "." + archive_format)
+        try:
+            fil = open(filename, "xb")
+        except FileExistsError:
+            raise IOError("File already exists. Will not overwrite")
+        try:
+            with fil:
+                for chunk in stream_archive(
+                    plan,
+                    archive_format=archive_format,
+                    rootdir=modname,
+                    compresslevel=compresslevel,
+                    min_size=min_size,
+                    modname=modname,
+                    config=config,
+                    creation_date=datetime.datetime.now(),
+                ):
+                    fil.write(chunk)
+        except BaseException:
+            os.remove(filename)
+            raise
+        return filename
 
     @classmethod
     def main(cls, modname=""):
@@ -212,7 +363,15 @@ class ProjectBase(object):
         """
 
         # Parse command line options/arguments
-        options = [("h", "help"), ("a", "add"), ("d:", "dir="), ("p:", "partial="), ("v", "version")]
+        options = [
+            ("h", "help"),
+            ("a", "add"),
+            ("d:", "dir="),
+            ("p:", "partial="),
+            ("u", "update"),
+            ("v", "version"),
+            ("z:", "archive="),
+        ]
         if cls.single_file:
             options.append(("s", "single-file"))
 
@@ -229,6 +388,8 @@ class ProjectBase(object):
         rootdir = "./"
         single_file = False
         partial = None
+        update = False
+        archive_format = None
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 cls.usage(0)
@@ -238,6 +399,12 @@ class ProjectBase(object):
                 rootdir = arg
             elif opt in ("-p", "--partial"):
                 partial = arg
+            elif opt in ("-u", "--update"):
+                update = True
+            elif opt in ("-z", "--archive"):
+                if arg not in ARCHIVE_FORMATS:
+                    cls.usage(3)
+                archive_format = arg
             elif opt in ("-s", "--single-file"):
                 single_file = True
             elif opt in ("-v", "--version"):
@@ -254,5 +421,52 @@ class ProjectBase(object):
 
         if single_file:
             cls.create_one(rootdir, modname)
+        elif archive_format:
+            cls.create_archive(rootdir, modname, partial=partial, archive_format=archive_format)
         else:
-            cls.create_all(rootdir, modname, add_to_existing=add_to_existing, partial=partial)
+            cls.create_all(rootdir, modname, add_to_existing=add_to_existing, partial=partial, update=update)
+
+
+def iter_project(
+    project_cls, modname, partial=None, files_to_ignore=None, stream=False, config=None, creation_date=None
+):
+    """Generates the files of a project one at a time, without writing them.
+    The template directory is walked lazily unless the build plan is already
+    cached (see `ProjectBase.get_plan`), so that the first files are
+    available before the whole template tree has been read.
+
+    Args:
+        project_cls (ProjectBase subclass): the project class
+        modname (str): the module name
+
+    Keyword args:
+        partial (str, default=None): name of the partial build that you want
+            to use. Partial build names are defined in the config file
+        files_to_ignore (list, default=None): list of file names to ignore.
+            Defaults to the `files_to_ignore` config parameter.
+        stream (bool, default=False): set to True to get the content of the
+            rendered files as iterators of chunks
+        config (dict, default=None): project configuration. Defaults to
+            `project_cls.get_config()`
+        creation_date (datetime.datetime, default=None): creation date.
+            Defaults to now
+
+    Yields:
+        (path relative to the project root, kind, payload) tuples (see
+        `entree.generation.iter_build`)
+    """
+    if config is None:
+        config = project_cls.get_config()
+    if creation_date is None:
+        creation_date = datetime.datetime.now()
+    partial = project_cls.get_partial_paths(config, partial)
+    if not files_to_ignore:
+        files_to_ignore = config.get("files_to_ignore", [])
+
+    plan = _PLAN_CACHE.get(project_cls._plan_key(partial, files_to_ignore))
+    if plan is None:
+        plan = iter_file_structure(
+            project_cls.template_path(), replace=project_cls.replace, files_to_ignore=files_to_ignore, partial=partial
+        )
+    for item in iter_build(plan, stream=stream, modname=modname, config=config, creation_date=creation_date):
+        yield item
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: entree.templatepack
+.. moduleauthor:: Julien Spronck
+.. created:: Oct 2026
+
+Module precompiling the templates shipped with the package and listing them
+in a manifest, when the package is built (see setup.py)
+"""
+
+import hashlib
+import json
+import os
+import zipfile
+
+from jinja2 import Environment, FileSystemLoader, ModuleLoader
+from jinja2.exceptions import TemplateSyntaxError
+
+from entree.generation import walk_template_tree
+from entree.utils import (
+    BINARY_EXTENSIONS,
+    TEMPLATE_MANIFEST,
+    TEMPLATE_PACK,
+    TEMPLATE_PACK_INDEX,
+    TEMPLATE_PACK_ROOT,
+    clear_template_cache,
+    get_package_version,
+    get_verbatim_length,
+    hash_file,
+)
+
+
+def build_template_pack(target=TEMPLATE_PACK, template_root=TEMPLATE_PACK_ROOT):
+    """Precompiles all templates found in `template_root` into a zip archive
+    of python modules that can be imported without parsing the templates.
+
+    Files that cannot be compiled (syntax errors, binary files) are left
+    out of the pack and will be rendered from source. The pack lists the
+    SHA-256 hash of each compiled source so that edited templates are
+    compiled again.
+
+    Keyword args:
+        target (str, default=TEMPLATE_PACK): path of the archive to create
+        template_root (str, default=TEMPLATE_PACK_ROOT): template directory
+
+    Returns:
+        list of the compiled template names
+    """
+    env = Environment(loader=FileSystemLoader(template_root, followlinks=True))
+    index = {"version": get_package_version(), "templates": {}}
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for name in env.list_templates(filter_func=lambda name: not name.lower().endswith(BINARY_EXTENSIONS)):
+            try:
+                source, filename, _ = env.loader.get_source(env, name)
+                code = env.compile(source, name, filename, raw=True, defer_init=True)
+            except (TemplateSyntaxError, UnicodeDecodeError):
+                continue
+            zipf.writestr(ModuleLoader.get_module_filename(name), code)
+            index["templates"][name] = hash_file(filename)
+        zipf.writestr(TEMPLATE_PACK_INDEX, json.dumps(index, indent=4, sort_keys=True))
+    clear_template_cache()
+    return sorted(index["templates"])
+
+
+def build_template_manifest(target=TEMPLATE_MANIFEST, template_root=TEMPLATE_PACK_ROOT):
+    """Lists all directories and files of each project template directory
+    (with their size, SHA-256 hash and whether they use Jinja) in a JSON
+    manifest, so that template trees do not need to be walked at runtime.
+
+    Keyword args:
+        target (str, default=TEMPLATE_MANIFEST): path of the manifest to
+            create
+        template_root (str, default=TEMPLATE_PACK_ROOT): template directory
+
+    Returns:
+        dict containing the manifest
+    """
+    manifest = {"version": get_package_version(), "projects": {}}
+    for project in sorted(os.listdir(template_root)):
+        project_path = os.path.join(template_root, project)
+        if not os.path.isdir(project_path):
+            continue
+        entries = []
+        for entry in walk_template_tree(project_path, use_manifest=False):
+            manifest_entry = {"path": entry.relpath.replace(os.sep, "/")}
+            if entry.is_dir:
+                manifest_entry["dir"] = True
+            else:
+                with open(entry.src, "rb") as fil:
+                    data = fil.read()
+                length = get_verbatim_length(entry.src)
+                manifest_entry["size"] = len(data)
+                manifest_entry["sha256"] = hashlib.sha256(data).hexdigest()
+                manifest_entry["jinja"] = length is None
+                manifest_entry["length"] = length
+            entries.append(manifest_entry)
+        manifest["projects"][project] = entries
+    with open(target, "w") as fil:
+        json.dump(manifest, fil, indent=1, sort_keys=True)
+    clear_template_cache()
+    return manifest
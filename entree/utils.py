@@ -9,25 +9,243 @@
 Simple module to create files and directories in a programming project
 """
 
-import fnmatch
+import collections
+import copy
+import hashlib
 import json
 import os
+import threading
 import time
 import zipfile
 
-from jinja2 import Template
+from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache, ModuleLoader, Template
 
 CONFIG_FILE_NAME = "entree_config.json"
 CONFIG_DIR = ""
+CACHE_DIR = ""
+
+# Set to False to disable the on-disk Jinja bytecode cache
+USE_BYTECODE_CACHE = True
+
+# Maximum number of compiled templates kept in memory
+TEMPLATE_CACHE_SIZE = 256
+
+# Maximum number of parsed config files kept in memory
+CONFIG_CACHE_SIZE = 8
+
+# Size (in characters) of the chunks written when streaming rendered files
+WRITE_CHUNK_SIZE = 64 * 1024
+
+# Strings starting a Jinja block, variable or comment
+JINJA_TOKENS = ("{{", "{%", "{#")
+
+# Extensions of template files that are always copied as binary assets
+BINARY_EXTENSIONS = (
+    ".eot",
+    ".gif",
+    ".ico",
+    ".jpeg",
+    ".jpg",
+    ".otf",
+    ".pdf",
+    ".png",
+    ".ttf",
+    ".webp",
+    ".woff",
+    ".woff2",
+    ".zip",
+)
+# Number of bytes inspected to detect binary files
+BINARY_SNIFF_SIZE = 8192
+
+PACKAGE_PATH = os.path.split(os.path.abspath(__file__))[0]
+# Templates shipped with the package and their precompiled version
+# (see `entree.templatepack.build_template_pack`)
+TEMPLATE_PACK_ROOT = os.path.join(PACKAGE_PATH, "projects", "templates")
+TEMPLATE_PACK = os.path.join(PACKAGE_PATH, "projects", "templates.zip")
+TEMPLATE_PACK_INDEX = "entree_index.json"
+# Listing of all template directories and files (see
+# `entree.templatepack.build_template_manifest`)
+TEMPLATE_MANIFEST = os.path.join(PACKAGE_PATH, "projects", "templates_manifest.json")
+
+# Named caches, for statistics (see `LRUCache`)
+CACHES = {}
+
+
+class LRUCache(object):
+    """Thread-safe least-recently-used cache with a bounded number of entries
+    and, optionally, a bounded total size.
+
+    Each entry is stored together with a stamp (e.g. the modification time
+    and size of a file). A lookup with a different stamp is a miss and the
+    stale entry is dropped.
+    """
+
+    def __init__(self, maxsize=128, name=None, maxbytes=None):
+        """Initialization
+
+        Keyword args:
+            maxsize (int, default=128): maximum number of entries
+            name (str, default=None): if given, the cache is listed in
+                CACHES under that name
+            maxbytes (int, default=None): maximum total size of the entries,
+                as given to `put`
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if name is not None:
+            CACHES[name] = self
+
+    def get(self, key, stamp=None):
+        """Returns the cached value for `key` or None if there is no valid
+        entry for that key and stamp.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                if entry is not None:
+                    del self._data[key]
+                    self.nbytes -= entry[2]
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, stamp=None, size=0):
+        """Stores a value in the cache, evicting the least recently used
+        entries if needed. Values larger than `maxbytes` are not stored.
+
+        Keyword args:
+            stamp (default=None): stamp of the entry
+            size (int, default=0): size of the value (e.g. in bytes)
+        """
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._data[key] = (stamp, value, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self.nbytes -= self._data.popitem(last=False)[1][2]
+
+    def clear(self):
+        """Removes all entries and resets the statistics"""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FrozenDict(dict):
+    """Immutable and hashable dict (see `freeze`)"""
+
+    __slots__ = ("_hash",)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("FrozenDict objects are immutable")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __repr__(self):
+        return "FrozenDict({0})".format(dict.__repr__(self))
+
+
+def freeze(value):
+    """Returns an immutable and hashable copy of a JSON-like value: dicts
+    become FrozenDict objects and lists become tuples.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(val)) for key, val in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(val) for val in value)
+    return value
+
+
+class _BytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache that never fails a render because the cache directory
+    is not writable.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+class _TemplateFileLoader(BaseLoader):
+    """Jinja loader where template names are file paths."""
+
+    def get_source(self, environment, template):
+        with open(template) as fil:
+            source = fil.read()
+        return source, template, lambda: True
+
+
+_TEMPLATE_CACHE = LRUCache(TEMPLATE_CACHE_SIZE, name="template")
+_NAME_TEMPLATE_CACHE = LRUCache(TEMPLATE_CACHE_SIZE, name="name_template")
+_VERBATIM_CACHE = LRUCache(4 * TEMPLATE_CACHE_SIZE, name="verbatim")
+_DIGEST_CACHE = LRUCache(4 * TEMPLATE_CACHE_SIZE, name="digest")
+_CONFIG_CACHE = LRUCache(CONFIG_CACHE_SIZE, name="config")
+_PROJECT_CONFIG_CACHE = LRUCache(CONFIG_CACHE_SIZE * 8, name="project_config")
+_TEMPLATE_LOADER = _TemplateFileLoader()
+_ENVIRONMENT = None
+_ENVIRONMENT_LOCK = threading.Lock()
+# None: not loaded yet, False: no usable template pack/manifest
+_TEMPLATE_PACK = None
+_TEMPLATE_MANIFEST = None
+
+
+def get_home_dir():
+    """Returns path for the home directory of the user running entree."""
+    username = os.getenv("SUDO_USER") or os.getenv("USER")
+    if not username:
+        return os.path.expanduser("~")
+    return os.path.expanduser("~" + username)
 
 
 def get_config_dir():
     """Returns path for the config directory."""
     if CONFIG_DIR:
         return CONFIG_DIR
-    username = os.getenv("SUDO_USER") or os.getenv("USER")
-    homedir = os.path.expanduser("~" + username)
-    return os.path.join(homedir, ".config")
+    return os.path.join(get_home_dir(), ".config")
+
+
+def get_cache_dir():
+    """Returns path for the cache directory (used for compiled templates)."""
+    if CACHE_DIR:
+        return CACHE_DIR
+    cachehome = os.getenv("XDG_CACHE_HOME") or os.path.join(get_home_dir(), ".cache")
+    return os.path.join(cachehome, "entree")
 
 
 def get_config_file():
@@ -37,17 +255,51 @@ def get_config_file():
     return configfile
 
 
+def _config_stamp(configfile):
+    """Returns a stamp identifying the current version of the config file,
+    creating the file if needed
+    """
+    try:
+        stat = os.stat(configfile)
+    except FileNotFoundError:
+        set_config()
+        stat = os.stat(configfile)
+    return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+
+def _read_config():
+    """Reads the config file, or gets it from the config cache if the file
+    did not change since it was last read. The returned dict is shared and
+    must not be modified.
+    """
+    configfile = get_config_file()
+    stamp = _config_stamp(configfile)
+    config = _CONFIG_CACHE.get(configfile, stamp)
+    if config is None:
+        with open(configfile) as fil:
+            config = json.load(fil)
+        _CONFIG_CACHE.put(configfile, config, stamp)
+    return config
+
+
 def read_config():
-    """Reads the config file
+    """Reads the config file. The parsed file is cached until the file
+    changes (modification time, inode or size), see `reload_config`.
 
     Returns:
         config: dict containing the configuration
     """
-    configfile = get_config_file()
-    if not os.path.exists(configfile):
-        set_config()
-    with open(configfile) as fil:
-        return json.load(fil)
+    return copy.deepcopy(_read_config())
+
+
+def reload_config():
+    """Forgets the cached config files and reads the config file again
+
+    Returns:
+        config: dict containing the configuration
+    """
+    _CONFIG_CACHE.clear()
+    return read_config()
 
 
 def get_config_param(param, value=None, project_type=None):
@@ -65,17 +317,39 @@ def get_config_param(param, value=None, project_type=None):
     Returns:
         config parameter
     """
-    config = read_config()
+    config = _read_config()
     if project_type and "project_config" in config and project_type in config["project_config"]:
         project = config["project_config"][project_type]
         if param in project:
-            return project[param]
+            return copy.deepcopy(project[param])
         return value
     if param in config:
-        return config[param]
+        return copy.deepcopy(config[param])
     return value
 
 
+def get_project_config(project_type):
+    """Gets the effective configuration for a project type: the config file
+    with the project-specific configuration (`project_config`) applied.
+    It is computed once and reused until the config file changes.
+
+    Args:
+        project_type (str): project type (project class name)
+
+    Returns:
+        FrozenDict containing the configuration, without `project_config`
+    """
+    source = _read_config()
+    config = _PROJECT_CONFIG_CACHE.get(project_type, source)
+    if config is None:
+        config = dict(source)
+        overrides = config.pop("project_config", {}).get(project_type, {})
+        config.update(overrides)
+        config = freeze(config)
+        _PROJECT_CONFIG_CACHE.put(project_type, config, source)
+    return config
+
+
 def set_config(overwrite=False, **config):
     """Sets the config parameters
 
@@ -100,33 +374,59 @@ def set_config(overwrite=False, **config):
     if not os.path.exists(configfile) or overwrite:
         with open(configfile, "w") as fil:
             json.dump(config, fil, indent=4, sort_keys=True)
+        _CONFIG_CACHE.clear()
 
 
-def create_general_file(fname, file_content, zipf=None):
+def open_new_file(fname):
+    """Opens a new file for writing in binary mode. Fails if the file
+    already exists (`O_CREAT | O_EXCL`) instead of checking for it first.
+    """
+    try:
+        fd = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    except FileExistsError:
+        raise IOError("File already exists. Will not overwrite")
+    return os.fdopen(fd, "wb")
+
+
+def create_general_file(fname, file_content, zipf=None, fsync=False):
     """Creates a file.
 
     Args:
         fname (str): file name
-        file_content (iterator): generator/iterator containing
-            the file content.
+        file_content (str or iterator): the file content or a
+            generator/iterator containing chunks of the file content
+            (see `stream_template`).
 
     Keyword args:
         zipf (zipfile.ZipFile, default=None)
-    """
+        fsync (bool, default=False): set to True to flush the file to disk
+            before returning
 
-    # if dirname and not os.path.exists(dirname):
-    #     os.makedirs(dirname)
+    Returns:
+        SHA-256 hash of the content written (hexadecimal digest)
+    """
+    if isinstance(file_content, str):
+        file_content = (file_content,)
+    digest = hashlib.sha256()
     if zipf is None:
-        if os.path.exists(fname):
-            raise IOError("File already exists. Will not overwrite")
-        with open(fname, "w") as fil:
-            for line in file_content:
-                fil.write(line)
+        with open_new_file(fname) as fil:
+            for chunk in file_content:
+                chunk = chunk.encode("utf-8")
+                digest.update(chunk)
+                fil.write(chunk)
+            if fsync:
+                fil.flush()
+                os.fsync(fil.fileno())
     else:
         data = zipfile.ZipInfo(fname)
         data.date_time = time.localtime(time.time())[:6]
         data.compress_type = zipfile.ZIP_DEFLATED
-        zipf.writestr(data, file_content)
+        with zipf.open(data, "w") as fil:
+            for chunk in file_content:
+                chunk = chunk.encode("utf-8")
+                digest.update(chunk)
+                fil.write(chunk)
+    return digest.hexdigest()
 
 
 def create_dirs(rootdir, *dirs):
@@ -145,6 +445,260 @@ def create_dirs(rootdir, *dirs):
             os.makedirs(thedir)
 
 
+def _file_stamp(filename):
+    """Returns a stamp identifying the current version of a file"""
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_environment():
+    """Returns the Jinja environment used to compile template files.
+
+    Unless `USE_BYTECODE_CACHE` is False, the environment stores compiled
+    templates in the cache directory (see `get_cache_dir`) so that new
+    processes do not need to recompile unchanged templates.
+    """
+    global _ENVIRONMENT
+    with _ENVIRONMENT_LOCK:
+        if _ENVIRONMENT is None:
+            bytecode_cache = None
+            if USE_BYTECODE_CACHE:
+                # Templates are still rendered without a usable cache
+                # directory, only compiled in every process
+                try:
+                    cachedir = get_cache_dir()
+                    os.makedirs(cachedir, exist_ok=True)
+                    bytecode_cache = _BytecodeCache(cachedir)
+                except (OSError, TypeError, KeyError):
+                    bytecode_cache = None
+            _ENVIRONMENT = Environment(loader=_TEMPLATE_LOADER, bytecode_cache=bytecode_cache, cache_size=0)
+        return _ENVIRONMENT
+
+
+def get_package_version():
+    """Returns the version of the entree package"""
+    from entree import __version__
+
+    return __version__
+
+
+def _get_template_pack():
+    """Returns the template pack as a (loader, index) tuple, or False if
+    there is no pack matching the installed version (e.g. in development
+    checkouts).
+    """
+    global _TEMPLATE_PACK
+    if _TEMPLATE_PACK is None:
+        pack = False
+        if os.path.exists(TEMPLATE_PACK):
+            try:
+                with zipfile.ZipFile(TEMPLATE_PACK) as zipf:
+                    index = json.loads(zipf.read(TEMPLATE_PACK_INDEX))
+            except (KeyError, ValueError, zipfile.BadZipFile):
+                index = {}
+            if index.get("version") == get_package_version():
+                pack = (ModuleLoader(TEMPLATE_PACK), index["templates"])
+        _TEMPLATE_PACK = pack
+    return _TEMPLATE_PACK
+
+
+def _load_packed_template(filename):
+    """Loads a template from the template pack.
+
+    Args:
+        filename (str): absolute path of the template source file
+
+    Returns:
+        jinja2.Template or None if the template is not in the pack or if
+        its source changed since the pack was built
+    """
+    if not filename.startswith(TEMPLATE_PACK_ROOT + os.sep):
+        return None
+    pack = _get_template_pack()
+    if not pack:
+        return None
+    loader, index = pack
+    name = os.path.relpath(filename, TEMPLATE_PACK_ROOT).replace(os.sep, "/")
+    if name not in index or index[name] != hash_file(filename):
+        return None
+    env = get_environment()
+    return loader.load(env, name, env.make_globals(None))
+
+
+def get_template(filename):
+    """Returns the compiled template for a template file.
+
+    Compiled templates are cached in memory and reloaded only when the
+    modification time or the size of the file changes. Templates that are
+    not in memory are loaded from the precompiled template pack or from the
+    bytecode cache when possible.
+
+    Args:
+        filename (str): the filename
+
+    Returns:
+        jinja2.Template
+    """
+    key = os.path.abspath(filename)
+    stamp = _file_stamp(key)
+    template = _TEMPLATE_CACHE.get(key, stamp)
+    if template is None:
+        template = _load_packed_template(key)
+        if template is None:
+            env = get_environment()
+            template = _TEMPLATE_LOADER.load(env, key, env.make_globals(None))
+        _TEMPLATE_CACHE.put(key, template, stamp)
+    return template
+
+
+def get_name_template(name):
+    """Returns the compiled template for a file name replacement pattern
+    (e.g. '{{ modname }}').
+
+    Args:
+        name (str): the replacement pattern
+
+    Returns:
+        jinja2.Template
+    """
+    template = _NAME_TEMPLATE_CACHE.get(name)
+    if template is None:
+        template = Template(name)
+        _NAME_TEMPLATE_CACHE.put(name, template)
+    return template
+
+
+def clear_template_cache():
+    """Empties the in-memory template caches. The Jinja environment is
+    recreated on the next render.
+    """
+    global _ENVIRONMENT, _TEMPLATE_PACK, _TEMPLATE_MANIFEST
+    with _ENVIRONMENT_LOCK:
+        _ENVIRONMENT = None
+    _TEMPLATE_PACK = None
+    _TEMPLATE_MANIFEST = None
+    _TEMPLATE_CACHE.clear()
+    _NAME_TEMPLATE_CACHE.clear()
+    _VERBATIM_CACHE.clear()
+    _DIGEST_CACHE.clear()
+
+
+def get_verbatim_length(filename):
+    """Checks whether a template file can be copied instead of rendered.
+
+    Binary files (files with a `BINARY_EXTENSIONS` extension, null bytes or
+    invalid UTF-8) are never rendered and are copied in full.
+
+    A text file without any Jinja token renders to its own content, except
+    that Jinja normalizes line endings and removes a single trailing newline.
+    Such a file can therefore be copied byte for byte as long as it has no
+    carriage return, leaving out the trailing newline if there is one.
+    The result is cached until the file changes, or read from the template
+    manifest for bundled templates that did not change since the manifest
+    was built.
+
+    Args:
+        filename (str): the filename
+
+    Returns:
+        number of bytes to copy, or None if the file needs to be rendered
+    """
+    key = os.path.abspath(filename)
+    stamp = _file_stamp(key)
+    manifest_entry = get_manifest_entry(key)
+    if (
+        manifest_entry is not None
+        and manifest_entry["size"] == stamp[1]
+        and manifest_entry["sha256"] == get_template_digest(key)
+    ):
+        return manifest_entry["length"]
+    entry = _VERBATIM_CACHE.get(key, stamp)
+    if entry is None:
+        # Entries are wrapped in a tuple since None is a valid result
+        entry = (_detect_verbatim_length(key, stamp[1]),)
+        _VERBATIM_CACHE.put(key, entry, stamp)
+    return entry[0]
+
+
+def _detect_verbatim_length(filename, size):
+    """Inspects a template file for `get_verbatim_length`"""
+    if filename.lower().endswith(BINARY_EXTENSIONS):
+        return size
+    with open(filename, "rb") as fil:
+        data = fil.read(BINARY_SNIFF_SIZE)
+        if b"\0" in data:
+            return size
+        data += fil.read()
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return len(data)
+    if "\r" in text or any(token in text for token in JINJA_TOKENS):
+        return None
+    return len(data) - 1 if data.endswith(b"\n") else len(data)
+
+
+def hash_file(filename, length=None):
+    """Returns the SHA-256 hash of the content of a file, or of its first
+    `length` bytes
+    """
+    digest = hashlib.sha256()
+    remaining = -1 if length is None else length
+    with open(filename, "rb") as fil:
+        while remaining:
+            chunk = fil.read(WRITE_CHUNK_SIZE if remaining < 0 else min(WRITE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= 0 if remaining < 0 else len(chunk)
+    return digest.hexdigest()
+
+
+def get_template_digest(filename, length=None):
+    """Returns the SHA-256 hash of a template file. The hash is cached until
+    the file changes.
+
+    Args:
+        filename (str): the filename
+
+    Keyword args:
+        length (int, default=None): only hash the first `length` bytes of
+            the file (see `get_verbatim_length`)
+
+    Returns:
+        hexadecimal digest (str)
+    """
+    path = os.path.abspath(filename)
+    stamp = _file_stamp(path)
+    if length == stamp[1]:
+        length = None
+    key = path if length is None else (path, length)
+    digest = _DIGEST_CACHE.get(key, stamp)
+    if digest is None:
+        digest = hash_file(path, length=length)
+        _DIGEST_CACHE.put(key, digest, stamp)
+    return digest
+
+
+def render_file_content(template_path, **kwargs):
+    """Returns the content of the file created from a template file.
+
+    Args:
+        template_path (str): the path for the template file
+
+    Keyword args:
+        **kwargs: dictionary containing the variables for templating
+
+    Returns:
+        bytes
+    """
+    length = get_verbatim_length(template_path)
+    if length is not None:
+        with open(template_path, "rb") as fil:
+            return fil.read(length)
+    return render_template(template_path, **kwargs).encode("utf-8")
+
+
 def render_template(filename, **kwargs):
     """Renders a template file given the variables defined in kwargs
 
@@ -157,14 +711,105 @@ def render_template(filename, **kwargs):
     Returns:
         string containing the content of the file after templating
     """
-    with open(filename) as fil:
-        template = Template(fil.read())
+    return get_template(filename).render(**kwargs)
 
-    return template.render(**kwargs)
+
+def stream_template(filename, **kwargs):
+    """Renders a template file piece by piece given the variables defined in
+    kwargs. The rendered content is yielded in chunks of about
+    `WRITE_CHUNK_SIZE` characters so that large files never have to be held
+    in memory.
+
+    Args:
+        filename (str): the filename
+
+    Keyword args:
+        **kwargs: dictionary containing the variables needed in the template
+
+    Yields:
+        strings containing consecutive parts of the file content
+    """
+    buffer = []
+    size = 0
+    for piece in get_template(filename).generate(**kwargs):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= WRITE_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def _get_template_manifest():
+    """Returns the template manifest as a dict with the manifest entries of
+    each project directory ("dirs") and of each file ("files"), indexed by
+    absolute path, or False if there is no manifest matching the installed
+    version (e.g. in development checkouts).
+    """
+    global _TEMPLATE_MANIFEST
+    if _TEMPLATE_MANIFEST is None:
+        index = False
+        try:
+            with open(TEMPLATE_MANIFEST) as fil:
+                manifest = json.load(fil)
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get("version") == get_package_version():
+            index = {"dirs": {}, "files": {}}
+            for project, entries in manifest["projects"].items():
+                project_path = os.path.join(TEMPLATE_PACK_ROOT, project)
+                index["dirs"][project_path] = entries
+                for manifest_entry in entries:
+                    if not manifest_entry.get("dir"):
+                        path = os.path.join(project_path, manifest_entry["path"].replace("/", os.sep))
+                        index["files"][path] = manifest_entry
+        _TEMPLATE_MANIFEST = index
+    return _TEMPLATE_MANIFEST
+
+
+def get_manifest_entries(path):
+    """Returns the manifest entries of a project template directory
+
+    Args:
+        path (str): the project template directory
+
+    Returns:
+        list of dict, or None if the directory is not in the manifest
+    """
+    manifest = _get_template_manifest()
+    if not manifest:
+        return None
+    return manifest["dirs"].get(os.path.abspath(path))
+
+
+def get_manifest_entry(filename):
+    """Returns the manifest entry of a template file
+
+    Args:
+        filename (str): the absolute path of the template file
+
+    Returns:
+        dict, or None if the file is not in the manifest
+    """
+    manifest = _get_template_manifest()
+    if not manifest:
+        return None
+    return manifest["files"].get(filename)
 
 
 def copy_file_structure(
-    rootdir, path, replace=None, files_to_ignore=None, partial=None, zipf=None, template_root=None, **kwargs
+    rootdir,
+    path,
+    replace=None,
+    files_to_ignore=None,
+    partial=None,
+    zipf=None,
+    template_root=None,
+    stream=False,
+    link_mode="copy",
+    **kwargs,
 ):
     """Walks through the file structure and copy all directories and files.
 
@@ -181,58 +826,25 @@ def copy_file_structure(
         zipf (zipfile.ZipFile, default=None)
         template_root (str, default=None): the path to the project template
         directory
+        stream (bool, default=False): set to True to render and write files
+            in chunks instead of rendering them in memory first
+        link_mode (str, default="copy"): how files copied verbatim are
+            materialized (see `entree.generation.copy_verbatim_file`)
         **kwargs: dictionary containing the variables for templating
     """
+    # entree.generation builds on this module
+    from entree.generation import execute_plan, plan_file_structure
+
     if not os.path.exists(rootdir) and zipf is None:
         raise IOError('Root directory not found: "' + rootdir + '"')
 
-    if not files_to_ignore:
-        files_to_ignore = get_config_param("files_to_ignore", [])
+    plan = plan_file_structure(
+        path, replace=replace, files_to_ignore=files_to_ignore, partial=partial, template_root=template_root
+    )
+    execute_plan(rootdir, plan, zipf=zipf, stream=stream, link_mode=link_mode, **kwargs)
 
-    if template_root is None:
-        template_root = path
-
-    for fname in os.listdir(path):
-        src = os.path.join(path, fname)
-        relpath = os.path.relpath(src, start=template_root)
-        if partial and src not in partial:
-            # Partial build: only files and dirs in the partial list
-            # will be created
-            continue
-        ignoring = False
-        for pat in files_to_ignore:
-            if fnmatch.fnmatch(fname, pat) or fnmatch.fnmatch(relpath, pat):
-                ignoring = True
-                break
-        if ignoring:
-            # file path is in the list of files to ignore
-            print("File ignored: `{0}`".format(src))
-            continue
-        if replace and fname in replace:
-            fname = Template(replace[fname]).render(**kwargs)
-        elif fname.endswith("_py.template"):
-            fname = fname[:-12] + ".py"
-
-        dst = os.path.join(rootdir, fname)
-        if os.path.isdir(src):
-            if not os.path.exists(dst) and zipf is None:
-                os.makedirs(dst)
-            copy_file_structure(
-                dst,
-                src,
-                replace=replace,
-                partial=partial,
-                files_to_ignore=files_to_ignore,
-                zipf=zipf,
-                template_root=template_root,
-                **kwargs,
-            )
-        elif os.path.isfile(src):
-            file_content = render_template(src, **kwargs)
-            create_general_file(dst, file_content, zipf=zipf)
-
-
-def create_single_file(rootdir, newfilename, template_path, zipf=None, **kwargs):
+
+def create_single_file(rootdir, newfilename, template_path, zipf=None, stream=False, **kwargs):
     """Creates a single file from a template.
 
     Args:
@@ -242,43 +854,37 @@ def create_single_file(rootdir, newfilename, template_path, zipf=None, **kwargs)
 
     Keyword args:
         zipf (zipfile.ZipFile, default=None)
+        stream (bool, default=False): set to True to render and write the
+            file in chunks instead of rendering it in memory first
         **kwargs: dictionary containing the variables for templating
     """
+    # entree.generation builds on this module
+    from entree.generation import create_file_from_template
+
     if not os.path.exists(rootdir):
         raise IOError('Root directory not found: "' + rootdir + '"')
 
-    file_content = render_template(template_path, **kwargs)
-
     dst = os.path.join(rootdir, newfilename)
 
-    create_general_file(dst, file_content, zipf=zipf)
+    create_file_from_template(dst, template_path, zipf=zipf, stream=stream, **kwargs)
 
 
 def get_all_dirs_and_files(rootdir, basename="", files_to_ignore=None):
     """Get all path names for template directories"""
+    # entree.generation builds on this module
+    from entree.generation import walk_template_tree
+
     dirs = []
     files = []
 
     if files_to_ignore is None:
         files_to_ignore = get_config_param("files_to_ignore", [])
 
-    for fname in os.listdir(rootdir):
-        subpath = os.path.join(rootdir, fname)
-        newbasename = os.path.join(basename, fname)
-        ignoring = False
-        for pat in files_to_ignore:
-            if fnmatch.fnmatch(fname, pat) or fnmatch.fnmatch(newbasename, pat):
-                ignoring = True
-                break
-        if ignoring:
-            continue
-        if os.path.isdir(subpath):
-            dirs.append(newbasename)
-            newdirs, newfiles = get_all_dirs_and_files(subpath, basename=newbasename, files_to_ignore=files_to_ignore)
-            dirs += newdirs
-            files += newfiles
-        elif os.path.isfile(subpath):
-            files.append(newbasename)
+    for entry in walk_template_tree(rootdir, basename=basename, files_to_ignore=files_to_ignore):
+        if entry.is_dir:
+            dirs.append(entry.relpath)
+        else:
+            files.append(entry.relpath)
     return dirs, files
 
 
@@ -303,8 +909,7 @@ def replace_pathname(pathname, replace=None, **kwargs):
         return os.path.join(*dirsplit)
     else:
         if pathname in replace:
-            template = Template(replace[pathname])
-            return template.render(**kwargs)
+            return get_name_template(replace[pathname]).render(**kwargs)
         if pathname.endswith("_py.template"):
             return pathname[:-12] + ".py"
         # No match in `replace` => returns the orginal name
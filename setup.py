@@ -6,9 +6,11 @@ Setup script for entree
 """
 
 import os
+import sys
 
 # from distutils.core import setup
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 _USERNAME = os.getenv("SUDO_USER") or os.getenv("USER")
 _HOME = os.path.expanduser("~" + _USERNAME)
@@ -27,6 +29,34 @@ def get_template_dirs(path, basename="templates"):
     return dirs
 
 
+class BuildPyWithTemplatePack(build_py):
+    """Builds the package, precompiles the project templates into
+    `entree/projects/templates.zip` and lists them in
+    `entree/projects/templates_manifest.json`
+    """
+
+    def run(self):
+        build_py.run(self)
+        if self.dry_run:
+            return
+        # Jinja2 is a build requirement (see pyproject.toml): the build fails
+        # without it rather than releasing a package without its template
+        # pack. Isolated builds do not have the source tree on the path, so
+        # the package is imported from the build directory.
+        sys.path.insert(0, os.path.abspath(self.build_lib))
+        try:
+            from entree.templatepack import build_template_manifest, build_template_pack
+        finally:
+            sys.path.pop(0)
+        projects_dir = os.path.join(self.build_lib, "entree", "projects")
+        target = os.path.join(projects_dir, "templates.zip")
+        names = build_template_pack(target=target, template_root="entree/projects/templates")
+        print("Precompiled {0} templates into {1}".format(len(names), target))
+        target = os.path.join(projects_dir, "templates_manifest.json")
+        build_template_manifest(target=target, template_root="entree/projects/templates")
+        print("Created template manifest {0}".format(target))
+
+
 TEMPLATE_PATHS = [
     os.path.join(directory, "*") for directory in ["templates"] + get_template_dirs("entree/projects/templates")
 ]
@@ -59,6 +89,7 @@ setup(
     url="http://frenetic.be/",
     # Installation information
     packages=find_packages(),
+    cmdclass={"build_py": BuildPyWithTemplatePack},
     entry_points={"console_scripts": ["entree = entree:main"]},
     data_files=DATA_FILES,
     package_data={
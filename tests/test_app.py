@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the entree web app
+"""
+
+import io
+import json
+import math
+import re
+import time
+import unittest
+import zipfile
+
+import app
+import entree.generation
+import entree.projects.base
+import entree.utils
+from utilities import random_string
+
+
+class TestFileStructure(unittest.TestCase):
+    """Testing the /filestructure route"""
+
+    def setUp(self):
+        """Start with an empty cache"""
+        app._FILESTRUCTURE_CACHE.clear()
+        self.client = app.app.test_client()
+
+    def test_cache(self):
+        """Test that repeated requests are answered from the cache"""
+        response = self.client.get("/filestructure/Python?projectname=foo")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/json")
+        files = json.loads(response.data)["files"]
+        self.assertEqual(files["setup_py.template"], "setup.py")
+        self.assertEqual(files["src/__init___py.template"], "foo/__init__.py")
+        self.assertEqual((app._FILESTRUCTURE_CACHE.hits, app._FILESTRUCTURE_CACHE.misses), (0, 1))
+
+        again = self.client.get("/filestructure/Python?projectname=foo")
+        self.assertEqual(again.data, response.data)
+        self.assertEqual(again.headers["ETag"], response.headers["ETag"])
+        self.assertEqual((app._FILESTRUCTURE_CACHE.hits, app._FILESTRUCTURE_CACHE.misses), (1, 1))
+
+    def test_project_names(self):
+        """Test that each project name gets its own entry"""
+        modname = "m" + random_string(8)
+        foo = self.client.get("/filestructure/Python?projectname=foo")
+        other = self.client.get("/filestructure/Python?projectname=" + modname)
+        self.assertEqual(len(app._FILESTRUCTURE_CACHE), 2)
+        self.assertNotEqual(foo.headers["ETag"], other.headers["ETag"])
+        self.assertEqual(json.loads(other.data)["files"]["src/__init___py.template"], modname + "/__init__.py")
+
+        default = self.client.get("/filestructure/Python")
+        self.assertEqual(json.loads(default.data)["dirs"]["src"], "src")
+        self.assertEqual(len(app._FILESTRUCTURE_CACHE), 3)
+
+    def test_not_modified(self):
+        """Test that a matching If-None-Match gets a 304"""
+        etag = self.client.get("/filestructure/Python?projectname=foo").headers["ETag"]
+        response = self.client.get("/filestructure/Python?projectname=foo", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        response = self.client.get("/filestructure/Python?projectname=bar", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_listing(self):
+        """Test that the listing is built from the plan, walking the
+        templates once
+        """
+        project_cls = app.CLASSES_BY_LONG_NAME["Python"]
+        dirs, files = entree.utils.get_all_dirs_and_files(
+            project_cls.template_path(), files_to_ignore=app.FILES_TO_IGNORE
+        )
+        walk_template_tree = entree.generation.walk_template_tree
+        walks = []
+
+        def record_walk(*args, **kwargs):
+            walks.append(args[0])
+            return walk_template_tree(*args, **kwargs)
+
+        entree.projects.base._PLAN_CACHE.clear()
+        entree.generation.walk_template_tree = record_walk
+        try:
+            response = self.client.get("/filestructure/Python?projectname=foo")
+        finally:
+            entree.generation.walk_template_tree = walk_template_tree
+        self.assertEqual(walks, [project_cls.template_path()])
+        self.assertEqual(
+            json.loads(response.data),
+            {
+                "dirs": entree.utils.filemap(dirs, replace=project_cls.replace, modname="foo"),
+                "files": entree.utils.filemap(files, replace=project_cls.replace, modname="foo"),
+            },
+        )
+
+    def test_unsupported_project_type(self):
+        """Test that unknown project types redirect to the home page"""
+        response = self.client.get("/filestructure/Cobol")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(app._FILESTRUCTURE_CACHE), 0)
+
+
+FORM = {
+    "email": "lily@example.com",
+    "name": "Lily",
+    "projectname": "foo",
+    "projecttype": "Python - Large Flask App",
+    "url": "example.com",
+}
+
+
+def reset_generation_pool(**config):
+    """Shuts the generation pool down so that it is created again with
+    `config`
+    """
+    if app._GENERATION_EXECUTOR is not None:
+        app._GENERATION_EXECUTOR.shutdown(wait=True)
+    app._GENERATION_EXECUTOR = None
+    app._GENERATION_SLOTS = None
+    app.app.config.update(config)
+
+
+def wait_for_generations(timeout=5):
+    """Waits until no generation is in flight. Returns True if none is."""
+    deadline = time.time() + timeout
+    while app._GENERATIONS_IN_FLIGHT and time.time() < deadline:
+        time.sleep(0.05)
+    return app._GENERATIONS_IN_FLIGHT == 0
+
+
+class TestGenerationPool(unittest.TestCase):
+    """Testing archive generation on the bounded pool"""
+
+    def setUp(self):
+        """Use a pool of a single thread"""
+        self.config = {
+            name: app.app.config[name]
+            for name in ["GENERATION_WORKERS", "GENERATION_QUEUE_DEPTH", "GENERATION_QUEUE_TIMEOUT"]
+        }
+        self.buffer_size = app.GENERATION_BUFFER_SIZE
+        self.stream_archive = app.stream_archive
+        # A single chunk ahead of the client, so that open downloads keep
+        # their thread
+        app.GENERATION_BUFFER_SIZE = 1
+        reset_generation_pool(GENERATION_WORKERS=1, GENERATION_QUEUE_DEPTH=0, GENERATION_QUEUE_TIMEOUT=5)
+        self.client = app.app.test_client()
+        self.downloads = []
+
+    def open_download(self):
+        """Starts a download without reading it"""
+        response = self.client.post("/submit", data=FORM, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.downloads.append(response)
+        next(iter(response.response))
+        return response
+
+    def test_download(self):
+        """Test that archives generated on the pool are complete"""
+        response = self.client.post("/submit", data=FORM)
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertIn("./foo/__init__.py", zipf.namelist())
+        self.assertTrue(wait_for_generations())
+
+    def test_saturated(self):
+        """Test that a saturated pool answers 503 right away and takes new
+        downloads once a client disconnects
+        """
+        download = self.open_download()
+        start = time.time()
+        response = self.client.post("/submit", data=FORM)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], str(app.app.config["GENERATION_RETRY_AFTER"]))
+
+        download.close()
+        self.assertTrue(wait_for_generations())
+        response = self.client.post("/submit", data=FORM)
+        self.assertEqual(response.status_code, 200)
+        response.get_data()
+        self.assertTrue(wait_for_generations())
+
+    def test_queue_timeout(self):
+        """Test that requests waiting too long for a thread get a 503"""
+        reset_generation_pool(GENERATION_QUEUE_DEPTH=1, GENERATION_QUEUE_TIMEOUT=0.2)
+        download = self.open_download()
+        response = self.client.post("/submit", data=FORM)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+
+        # The queued generation gives its slot back right away
+        self.assertEqual(app._GENERATIONS_IN_FLIGHT, 1)
+        download.close()
+        self.assertTrue(wait_for_generations())
+
+    def test_slow_first_chunk(self):
+        """Test that a running generation whose first chunk is too slow gets
+        a 503 and releases its slot
+        """
+        reset_generation_pool(GENERATION_QUEUE_TIMEOUT=0.2)
+
+        def slow_archive(*args, **kwargs):
+            time.sleep(0.5)
+            yield b"PK"
+
+        app.stream_archive = slow_archive
+        response = self.client.post("/submit", data=FORM)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assertTrue(wait_for_generations())
+
+        app.stream_archive = self.stream_archive
+        response = self.client.post("/submit", data=FORM)
+        self.assertEqual(response.status_code, 200)
+        response.get_data()
+
+    def test_first_chunk_error(self):
+        """Test that errors in the first file redirect to the home page and
+        release the slot
+        """
+
+        def broken_archive(*args, **kwargs):
+            raise RuntimeError("Broken template")
+            yield b""
+
+        app.stream_archive = broken_archive
+        response = self.client.post("/submit", data=FORM)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("error=", response.headers["Location"])
+        self.assertTrue(wait_for_generations())
+
+        app.stream_archive = self.stream_archive
+        response = self.client.post("/submit", data=FORM)
+        self.assertEqual(response.status_code, 200)
+        response.get_data()
+
+    def tearDown(self):
+        """Restore the generation pool"""
+        for download in self.downloads:
+            download.close()
+        app.stream_archive = self.stream_archive
+        app.GENERATION_BUFFER_SIZE = self.buffer_size
+        reset_generation_pool(**self.config)
+
+
+def parse_metrics(text):
+    """Parses metrics in the Prometheus text format
+
+    Returns:
+        (samples, types) where samples maps (name, frozenset of labels) to
+        values and types maps metric names to their type
+    """
+    samples = {}
+    types = {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+            continue
+        if line.startswith("#"):
+            continue
+        match = re.match(r"^(\w+)(?:\{(.*)\})? (\S+)$", line)
+        labels = re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2) or "")
+        samples[(match.group(1), frozenset(labels))] = float(match.group(3))
+    return samples, types
+
+
+class TestMetrics(unittest.TestCase):
+    """Testing the /metrics route"""
+
+    def setUp(self):
+        """Setting up"""
+        self.client = app.app.test_client()
+
+    def get_metrics(self):
+        """Returns the parsed metrics"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, app.METRICS_MIMETYPE)
+        return parse_metrics(response.get_data(as_text=True))
+
+    def test_requests(self):
+        """Test the request counters and duration histograms"""
+        labels = frozenset([("endpoint", "filestructure"), ("method", "GET"), ("status", "200")])
+        samples, _ = self.get_metrics()
+        before = samples.get(("entree_requests_total", labels), 0)
+        for _ in range(3):
+            self.client.get("/filestructure/Python?projectname=foo")
+        self.client.get("/")
+        samples, types = self.get_metrics()
+        self.assertEqual(samples[("entree_requests_total", labels)], before + 3)
+        self.assertEqual(types["entree_requests_total"], "counter")
+        self.assertEqual(types["entree_request_duration_seconds"], "histogram")
+        self.assertFalse([key for key in samples if ("endpoint", "home") in key[1]])
+
+        # Cumulative buckets, the last one being +Inf
+        endpoint = ("endpoint", "filestructure")
+        buckets = sorted(
+            (float(dict(key[1])["le"]), value)
+            for key, value in samples.items()
+            if key[0] == "entree_request_duration_seconds_bucket" and endpoint in key[1]
+        )
+        self.assertEqual(len(buckets), len(app.METRICS_BUCKETS) + 1)
+        self.assertEqual(buckets[-1][0], float("inf"))
+        counts = [count for _, count in buckets]
+        self.assertEqual(counts, sorted(counts))
+        total = samples[("entree_request_duration_seconds_count", frozenset([endpoint]))]
+        self.assertEqual(counts[-1], total)
+        self.assertGreaterEqual(total, 3)
+
+    def test_generations(self):
+        """Test the archive and phase metrics and the in-flight gauge"""
+        samples, _ = self.get_metrics()
+        zip_format = frozenset([("format", "zip")])
+        before = samples.get(("entree_archives_total", zip_format), 0)
+        bytes_before = samples.get(("entree_archive_bytes_total", zip_format), 0)
+        response = self.client.post("/submit", data=FORM)
+        data = response.get_data()
+        self.assertTrue(wait_for_generations())
+        samples, types = self.get_metrics()
+        self.assertEqual(samples[("entree_archives_total", zip_format)], before + 1)
+        self.assertEqual(samples[("entree_archive_bytes_total", zip_format)], bytes_before + len(data))
+        self.assertEqual(samples[("entree_generations_in_flight", frozenset())], 0)
+        self.assertEqual(types["entree_generations_in_flight"], "gauge")
+        for phase in app.METRICS_PHASES:
+            self.assertGreaterEqual(samples[("entree_phase_duration_seconds_count", frozenset([("phase", phase)]))], 1)
+
+    def test_walk_phase(self):
+        """Test that only generations that run time the walk phase"""
+        walk = frozenset([("phase", "walk")])
+        response = self.client.post("/submit", data=FORM)
+        response.get_data()
+        self.assertTrue(wait_for_generations())
+        samples, _ = self.get_metrics()
+        before = samples[("entree_phase_duration_seconds_count", walk)]
+
+        # Not modified, precondition failed and busy
+        headers = {"If-None-Match": response.headers["ETag"]}
+        self.assertEqual(self.client.get("/submit", query_string=FORM, headers=headers).status_code, 304)
+        self.assertEqual(self.client.post("/submit", data=FORM, headers=headers).status_code, 412)
+        generate_in_background = app.generate_in_background
+        app.generate_in_background = lambda chunks: chunks.close()
+        try:
+            self.assertEqual(self.client.post("/submit", data=FORM).status_code, 503)
+        finally:
+            app.generate_in_background = generate_in_background
+        self.client.get("/filestructure/Python?projectname=" + random_string(16))
+        samples, _ = self.get_metrics()
+        self.assertEqual(samples[("entree_phase_duration_seconds_count", walk)], before)
+
+    def test_filestructure(self):
+        """Test the /filestructure build histogram"""
+        labels = frozenset([("project", "Python")])
+        samples, types = self.get_metrics()
+        before = samples.get(("entree_filestructure_build_seconds_count", labels), 0)
+        modname = random_string(16)
+        for _ in range(2):
+            self.client.get("/filestructure/Python?projectname=" + modname)
+        samples, types = self.get_metrics()
+        self.assertEqual(types["entree_filestructure_build_seconds"], "histogram")
+        self.assertEqual(samples[("entree_filestructure_build_seconds_count", labels)], before + 1)
+
+    def test_caches(self):
+        """Test the cache statistics"""
+        name = random_string(16)
+        cache = entree.utils.LRUCache(maxsize=2, name=name)
+        try:
+            labels = frozenset([("cache", name)])
+            samples, _ = self.get_metrics()
+            self.assertTrue(math.isnan(samples[("entree_cache_hit_ratio", labels)]))
+            cache.put("a", 1)
+            cache.get("a")
+            cache.get("b")
+            cache.get("a")
+            samples, _ = self.get_metrics()
+            self.assertEqual(samples[("entree_cache_hits_total", labels)], 2)
+            self.assertEqual(samples[("entree_cache_misses_total", labels)], 1)
+            self.assertAlmostEqual(samples[("entree_cache_hit_ratio", labels)], 2 / 3)
+            self.assertEqual(samples[("entree_cache_entries", labels)], 1)
+        finally:
+            del entree.utils.CACHES[name]
+
+    def test_histogram(self):
+        """Test that histogram buckets are cumulative"""
+        histogram = app.Histogram(buckets=(0.1, 1.0))
+        for value in [0.05, 0.5, 0.5, 5]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 3])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 6.05)
+
+    def test_format(self):
+        """Test the label escaping and sample formatting"""
+        self.assertEqual(app._format_labels([]), "")
+        self.assertEqual(app._format_labels([("a", 'x"y\\z\n')]), '{a="x\\"y\\\\z\\n"}')
+        lines = []
+        histogram = app.Histogram(buckets=(1.0,))
+        histogram.observe(2.5)
+        app._format_metric(lines, "foo_seconds", "histogram", "Foo.", [([("a", "b")], histogram)])
+        self.assertEqual(
+            lines,
+            [
+                "# HELP foo_seconds Foo.",
+                "# TYPE foo_seconds histogram",
+                'foo_seconds_bucket{a="b",le="1.0"} 0',
+                'foo_seconds_bucket{a="b",le="+Inf"} 1',
+                'foo_seconds_sum{a="b"} 2.5',
+                'foo_seconds_count{a="b"} 1',
+            ],
+        )
+        lines = []
+        app._format_metric(lines, "foo_ratio", "gauge", "Foo.", [([], float("nan"))])
+        self.assertEqual(lines[-1], "foo_ratio NaN")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for entree.archive
+"""
+
+import datetime
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+import tarfile
+import unittest
+import zipfile
+
+import entree.archive
+import entree.generation
+import entree.utils
+from utilities import random_string
+
+
+class TestStreamZip(unittest.TestCase):
+    """Testing zip archives created on the fly"""
+
+    def setUp(self):
+        """Create a fake file structure to test"""
+        self.template_dir = random_string(16)
+        os.makedirs(os.path.join(self.template_dir, "b"))
+        self.file_a = os.path.join(self.template_dir, "a.txt")
+        self.file_b = os.path.join(self.template_dir, "b", "b_py.template")
+        entree.utils.create_general_file(self.file_a, "My name is")
+        entree.utils.create_general_file(self.file_b, "{% for i in range(100) %}{{ name }}\n{% endfor %}")
+
+    def test_stream_sink(self):
+        """Test that the sink cannot seek"""
+        sink = entree.archive.StreamSink()
+        self.assertFalse(sink.seekable())
+        with self.assertRaises(OSError):
+            sink.tell()
+        sink.write(b"abc")
+        sink.write(b"de")
+        self.assertEqual(sink.drain(), b"abcde")
+        self.assertEqual(sink.drain(), b"")
+
+    def test_stream_zip(self):
+        """Test that the chunks form the same archive as a zip file"""
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        chunks = list(entree.archive.stream_zip(plan, name="Lily"))
+        self.assertGreater(len(chunks), 2)
+
+        memory_file = io.BytesIO()
+        with zipfile.ZipFile(memory_file, "w") as zipf:
+            entree.generation.execute_plan("", plan, zipf=zipf, name="Lily")
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zstream, zipfile.ZipFile(memory_file) as zmemory:
+            self.assertIsNone(zstream.testzip())
+            self.assertEqual(zstream.namelist(), zmemory.namelist())
+            for name in zmemory.namelist():
+                self.assertEqual(zstream.read(name), zmemory.read(name))
+            self.assertEqual(zstream.read(os.path.join("b", "b.py")), b"Lily\n" * 100)
+
+    def test_stream_zip_rootdir(self):
+        """Test the member names with a root directory"""
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        data = b"".join(entree.archive.stream_zip(plan, rootdir="foo", name="Lily"))
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            self.assertEqual(sorted(zipf.namelist()), [os.path.join("foo", "a.txt"), os.path.join("foo", "b", "b.py")])
+
+    def test_stream_archive_formats(self):
+        """Test that all archive formats contain the same files"""
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        for archive_format in entree.archive.ARCHIVE_FORMATS:
+            chunks = entree.archive.stream_archive(plan, archive_format=archive_format, compresslevel=1, name="Lily")
+            data = b"".join(chunks)
+            if archive_format == "zip":
+                with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+                    content = {name: zipf.read(name) for name in zipf.namelist()}
+            else:
+                with tarfile.open(fileobj=io.BytesIO(data)) as tarf:
+                    self.assertTrue(tarf.getmember("b").isdir())
+                    content = {info.name: tarf.extractfile(info).read() for info in tarf if info.isfile()}
+            self.assertEqual(content, {"a.txt": b"My name is", os.path.join("b", "b.py"): b"Lily\n" * 100})
+
+    def test_zip_compression(self):
+        """Test that small and incompressible members are stored"""
+        with open(os.path.join(self.template_dir, "logo.png"), "wb") as fil:
+            fil.write(b"\x89PNG" * 100)
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        data = b"".join(entree.archive.stream_archive(plan, min_size=50, name="Lily"))
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            self.assertEqual(zipf.getinfo("a.txt").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zipf.getinfo("logo.png").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zipf.getinfo(os.path.join("b", "b.py")).compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(zipf.read("logo.png"), b"\x89PNG" * 100)
+
+    def test_precompressed_members(self):
+        """Test that static members are compressed once and spliced into
+        valid archives
+        """
+        with open(os.path.join(self.template_dir, "logo.png"), "wb") as fil:
+            fil.write(b"\x89PNG" * 100)
+        with open(os.path.join(self.template_dir, "data.bin"), "wb") as fil:
+            fil.write(bytes(range(256)) * 10)
+        entree.archive._COMPRESSED_CACHE.clear()
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        for _ in range(2):
+            data = b"".join(entree.archive.stream_zip(plan, name="Lily"))
+            with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+                self.assertIsNone(zipf.testzip())
+                self.assertEqual(zipf.read("a.txt"), b"My name is")
+                self.assertEqual(zipf.read("logo.png"), b"\x89PNG" * 100)
+                self.assertEqual(zipf.read("data.bin"), bytes(range(256)) * 10)
+                self.assertEqual(zipf.read(os.path.join("b", "b.py")), b"Lily\n" * 100)
+                self.assertEqual(zipf.getinfo("data.bin").compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zipf.getinfo("logo.png").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(entree.archive._COMPRESSED_CACHE.misses, 3)
+        self.assertEqual(entree.archive._COMPRESSED_CACHE.hits, 3)
+
+        # Seekable output
+        memory_file = io.BytesIO()
+        writer = entree.archive.get_archive_writer(memory_file)
+        writer.add_copy("data.bin", os.path.join(self.template_dir, "data.bin"), 100)
+        writer.add_file("b.py", b"Lily")
+        writer.close()
+        with zipfile.ZipFile(memory_file) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.read("data.bin"), bytes(range(100)))
+
+    def test_zip_format(self):
+        """Test that zip archives are written the way zipfile writes them"""
+        members = [
+            ("a.txt", b"My name is Lily\n" * 20, zipfile.ZIP_DEFLATED),
+            ("b/logo.png", b"\x89PNG" * 100, zipfile.ZIP_STORED),
+            ("caf\u00e9.txt", b"", zipfile.ZIP_DEFLATED),
+        ]
+        memory_file = io.BytesIO()
+        writer = entree.archive.get_archive_writer(memory_file, timestamp=1500000000)
+        for name, content, _ in members:
+            writer.add_file(name, content)
+        writer.close()
+
+        expected = io.BytesIO()
+        with zipfile.ZipFile(expected, "w") as zipf:
+            for name, content, compress_type in members:
+                info = zipfile.ZipInfo(name, date_time=(2017, 7, 14, 2, 40, 0))
+                info.compress_type = compress_type
+                info.create_system = 3
+                info.external_attr = 0o644 << 16
+                zipf.writestr(info, content)
+        self.assertEqual(memory_file.getvalue(), expected.getvalue())
+
+        with zipfile.ZipFile(memory_file) as zipf:
+            self.assertIsNone(zipf.testzip())
+            for name, content, _ in members:
+                self.assertEqual(zipf.read(name), content)
+            self.assertEqual(zipf.getinfo("caf\u00e9.txt").flag_bits, entree.archive.ZIP_UTF8_FLAG)
+
+    def test_parallel_compression(self):
+        """Test that members compressed concurrently are written in order"""
+        for index in range(20):
+            with open(os.path.join(self.template_dir, "data{0:02d}.bin".format(index)), "wb") as fil:
+                fil.write(os.urandom(64) * 200 + bytes([index]))
+        min_size = entree.archive.PARALLEL_MIN_SIZE
+        entree.archive.PARALLEL_MIN_SIZE = 0
+        try:
+            plan = entree.generation.plan_file_structure(self.template_dir)
+            expected = b"".join(entree.archive.stream_zip(plan, name="Lily"))
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for window in [1, 3, 100]:
+                    data = b"".join(entree.archive.stream_zip(plan, executor=executor, window=window, name="Lily"))
+                    with zipfile.ZipFile(io.BytesIO(data)) as zipf, zipfile.ZipFile(io.BytesIO(expected)) as zexp:
+                        self.assertIsNone(zipf.testzip())
+                        self.assertEqual(zipf.namelist(), zexp.namelist())
+                        for name in zexp.namelist():
+                            self.assertEqual(zipf.read(name), zexp.read(name))
+        finally:
+            entree.archive.PARALLEL_MIN_SIZE = min_size
+
+    def test_archive_timings(self):
+        """Test that the rendering and compression times are recorded"""
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        timings = {}
+        chunks = entree.archive.stream_archive(plan, timings=timings, name="Lily")
+        self.assertEqual(timings, {})
+        b"".join(chunks)
+        self.assertEqual(sorted(timings), ["compress", "render"])
+        self.assertGreater(timings["render"], 0)
+        self.assertGreater(timings["compress"], 0)
+
+    def test_archive_options(self):
+        """Test that invalid archive options are rejected"""
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        with self.assertRaises(ValueError):
+            list(entree.archive.stream_archive(plan, archive_format="rar"))
+        with self.assertRaises(ValueError):
+            list(entree.archive.stream_archive(plan, compresslevel=10))
+
+    def test_reproducible_archives(self):
+        """Test that archives with a fixed timestamp are identical"""
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        for archive_format in entree.archive.ARCHIVE_FORMATS:
+            archives = [
+                b"".join(entree.archive.stream_archive(plan, archive_format=archive_format, timestamp=0, name="Lily"))
+                for _ in range(2)
+            ]
+            self.assertEqual(archives[0], archives[1])
+
+        data = b"".join(entree.archive.stream_zip(plan, timestamp=1500000000, name="Lily"))
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            for info in zipf.infolist():
+                self.assertEqual(info.date_time, (2017, 7, 14, 2, 40, 0))
+                self.assertEqual(info.external_attr, 0o644 << 16)
+
+    def test_reproducible_parallel_archives(self):
+        """Test that archives do not depend on the executor or on the size
+        limits of the parallel compression and of the compressed cache
+        """
+        for index in range(6):
+            with open(os.path.join(self.template_dir, "data{0}.bin".format(index)), "wb") as fil:
+                fil.write(os.urandom(64) * 100 * index)
+        min_size = entree.archive.PARALLEL_MIN_SIZE
+        max_size = entree.archive.COMPRESSED_CACHE_MAX_SIZE
+        try:
+            plan = entree.generation.plan_file_structure(self.template_dir)
+            expected = b"".join(entree.archive.stream_zip(plan, timestamp=0, name="Lily"))
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for limits in [(0, 0), (4096, 10000)]:
+                    entree.archive.PARALLEL_MIN_SIZE, entree.archive.COMPRESSED_CACHE_MAX_SIZE = limits
+                    for pool in [None, executor]:
+                        data = b"".join(entree.archive.stream_zip(plan, executor=pool, timestamp=0, name="Lily"))
+                        self.assertEqual(data, expected)
+        finally:
+            entree.archive.PARALLEL_MIN_SIZE = min_size
+            entree.archive.COMPRESSED_CACHE_MAX_SIZE = max_size
+
+    def test_archive_etag(self):
+        """Test that the entity tag changes with the archive content"""
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        etag = entree.archive.get_archive_etag(plan, timestamp=0, name="Lily")
+        self.assertEqual(etag, entree.archive.get_archive_etag(plan, timestamp=0, name="Lily"))
+        self.assertNotEqual(etag, entree.archive.get_archive_etag(plan, timestamp=0, name="Rose"))
+        self.assertNotEqual(etag, entree.archive.get_archive_etag(plan, timestamp=1, name="Lily"))
+        self.assertNotEqual(etag, entree.archive.get_archive_etag(plan, archive_format="tar", timestamp=0, name="Lily"))
+
+        with open(self.file_a, "a") as fil:
+            fil.write(" Lily")
+        os.utime(self.file_a, ns=(0, 0))
+        self.assertNotEqual(etag, entree.archive.get_archive_etag(plan, timestamp=0, name="Lily"))
+
+    def test_reproducible_date(self):
+        """Test the creation date of reproducible archives"""
+        date = datetime.datetime(2018, 5, 17, 13, 42, 7, 123)
+        self.assertEqual(entree.archive.get_reproducible_date(date), datetime.datetime(2018, 5, 1))
+
+    def tearDown(self):
+        """Get rid of the temporary file structure"""
+        if os.path.exists(self.template_dir):
+            shutil.rmtree(self.template_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,10 +6,13 @@ Tests for entree.projects
 """
 
 import os
+import tarfile
 import unittest
 
+import entree.generation
 import entree.utils
 import entree.projects.base as base
+from entree.projects import CLASSES_BY_LONG_NAME, CLASS_LONG_NAMES, iter_project
 from utilities import get_file_content, TMPFile, print_header
 
 CLASSES = base.ProjectBase.__subclasses__()
@@ -294,6 +297,191 @@ class TestFileCreationIgnore(unittest.TestCase):
         entree.utils.CONFIG_DIR = self.cdir
 
 
+class TestProjectPlan(unittest.TestCase):
+    """Testing the build plans of the projects"""
+
+    def test_plan_cache(self):
+        """Testing that plans are computed once per project class"""
+        for project_cls in CLASSES:
+            plan = project_cls.get_plan(files_to_ignore=[".DS_Store"])
+            self.assertIs(project_cls.get_plan(files_to_ignore=[".DS_Store"]), plan)
+            self.assertIsNot(project_cls.get_plan(files_to_ignore=[".DS_Store", "*.md"]), plan)
+
+    def test_plan_content(self):
+        """Testing that plans contain all template files"""
+        for project_cls in CLASSES:
+            plan = project_cls.get_plan(files_to_ignore=[".DS_Store"])
+            tpath = project_cls.template_path()
+            dirs, files = entree.utils.get_all_dirs_and_files(tpath, files_to_ignore=[".DS_Store"])
+            self.assertEqual(
+                sorted(os.path.relpath(op.src, tpath) for op in plan if op.action == "mkdir"), sorted(dirs)
+            )
+            self.assertEqual(
+                sorted(os.path.relpath(op.src, tpath) for op in plan if op.action != "mkdir"), sorted(files)
+            )
+
+
+class TestProjectUpdate(unittest.TestCase):
+    """Testing updates of existing projects"""
+
+    def setUp(self):
+        """Setting up"""
+        self.cfile = entree.utils.CONFIG_FILE_NAME
+        self.cdir = entree.utils.CONFIG_DIR
+        entree.utils.CONFIG_FILE_NAME = "entree_config_test.json"
+        entree.utils.CONFIG_DIR = "tests/"
+
+    def test_update(self):
+        """Testing that updates keep local modifications and restore
+        deleted files
+        """
+        for project_cls in CLASSES:
+            with TMPFile() as rootdir:
+                with TMPFile(root=rootdir) as project:
+                    project_cls.create_all(rootdir, project)
+                    gendir = os.path.join(rootdir, project)
+                    manifest = entree.generation.read_generation_manifest(gendir)
+                    self.assertTrue(manifest["creation_date"])
+                    self.assertTrue(manifest["files"])
+
+                    relpaths = sorted(manifest["files"])
+                    modified = os.path.join(gendir, relpaths[0])
+                    deleted = os.path.join(gendir, relpaths[-1])
+                    with open(modified, "w") as fil:
+                        fil.write("local change")
+                    with open(deleted, "rb") as fil:
+                        content = fil.read()
+                    os.remove(deleted)
+
+                    project_cls.create_all(rootdir, project, update=True)
+                    with open(modified) as fil:
+                        self.assertEqual(fil.read(), "local change")
+                    with open(deleted, "rb") as fil:
+                        self.assertEqual(fil.read(), content)
+                    self.assertEqual(entree.generation.read_generation_manifest(gendir), manifest)
+
+    def tearDown(self):
+        """Tearing down"""
+        entree.utils.CONFIG_FILE_NAME = self.cfile
+        entree.utils.CONFIG_DIR = self.cdir
+
+
+class TestStagedProjectBuilds(unittest.TestCase):
+    """Testing that projects are built in a temporary directory"""
+
+    def setUp(self):
+        """Setting up"""
+        self.cfile = entree.utils.CONFIG_FILE_NAME
+        self.cdir = entree.utils.CONFIG_DIR
+        entree.utils.CONFIG_FILE_NAME = "entree_config_test.json"
+        entree.utils.CONFIG_DIR = "tests/"
+
+    def test_staged_build(self):
+        """Testing that only the project directory is left in the root
+        directory, whatever the fsync policy
+        """
+        for project_cls in CLASSES:
+            for fsync in entree.generation.FSYNC_POLICIES:
+                with TMPFile() as rootdir:
+                    project_cls.create_all(rootdir, "foo", fsync=fsync)
+                    self.assertEqual(os.listdir(rootdir), ["foo"])
+                    self.assertTrue(entree.generation.read_generation_manifest(os.path.join(rootdir, "foo"))["files"])
+
+    def test_failed_build(self):
+        """Testing that failed builds leave nothing behind"""
+
+        def get_template(filename):
+            raise ValueError("Broken template: `{0}`".format(filename))
+
+        original = entree.utils.get_template
+        entree.utils.get_template = get_template
+        try:
+            for project_cls in CLASSES:
+                with TMPFile() as rootdir:
+                    with self.assertRaises(ValueError):
+                        project_cls.create_all(rootdir, "foo")
+                    self.assertEqual(os.listdir(rootdir), [])
+        finally:
+            entree.utils.get_template = original
+
+    def tearDown(self):
+        """Tearing down"""
+        entree.utils.CONFIG_FILE_NAME = self.cfile
+        entree.utils.CONFIG_DIR = self.cdir
+
+
+class TestIterProject(unittest.TestCase):
+    """Testing project generation without writing files"""
+
+    def setUp(self):
+        """Setting up"""
+        self.cfile = entree.utils.CONFIG_FILE_NAME
+        self.cdir = entree.utils.CONFIG_DIR
+        entree.utils.CONFIG_FILE_NAME = "entree_config_test.json"
+        entree.utils.CONFIG_DIR = "tests/"
+
+    def test_iter_project(self):
+        """Testing that iter_project yields the files created by create_all"""
+        for project_cls in CLASSES:
+            with TMPFile() as rootdir:
+                project_cls.create_all(rootdir, "foo")
+                gendir = os.path.join(rootdir, "foo")
+                relpaths = set()
+                for relpath, kind, payload in iter_project(project_cls, "foo"):
+                    relpaths.add(relpath)
+                    path = os.path.join(gendir, relpath)
+                    if kind == "dir":
+                        self.assertTrue(os.path.isdir(path))
+                        continue
+                    with open(path, "rb") as fil:
+                        content = fil.read()
+                    if kind == "copy":
+                        src, length = payload
+                        with open(src, "rb") as fil:
+                            self.assertEqual(content, fil.read(length))
+                    else:
+                        self.assertEqual(content.decode("utf-8"), payload)
+                for dirpath, dirnames, filenames in os.walk(gendir):
+                    for name in dirnames + filenames:
+                        relpath = os.path.relpath(os.path.join(dirpath, name), gendir)
+                        if relpath != entree.generation.GENERATION_MANIFEST:
+                            self.assertIn(relpath, relpaths)
+
+    def tearDown(self):
+        """Tearing down"""
+        entree.utils.CONFIG_FILE_NAME = self.cfile
+        entree.utils.CONFIG_DIR = self.cdir
+
+
+class TestProjectArchive(unittest.TestCase):
+    """Testing archives of projects"""
+
+    def setUp(self):
+        """Setting up"""
+        self.cfile = entree.utils.CONFIG_FILE_NAME
+        self.cdir = entree.utils.CONFIG_DIR
+        entree.utils.CONFIG_FILE_NAME = "entree_config_test.json"
+        entree.utils.CONFIG_DIR = "tests/"
+
+    def test_create_archive(self):
+        """Testing that archives contain the files created by create_all"""
+        for project_cls in CLASSES:
+            with TMPFile() as rootdir:
+                project_cls.create_all(rootdir, "foo")
+                filename = project_cls.create_archive(rootdir, "foo", archive_format="tar.gz")
+                self.assertEqual(filename, os.path.join(rootdir, "foo.tar.gz"))
+                with tarfile.open(filename) as tarf:
+                    for info in tarf:
+                        self.assertTrue(os.path.exists(os.path.join(rootdir, info.name)))
+                with self.assertRaises(IOError):
+                    project_cls.create_archive(rootdir, "foo", archive_format="tar.gz")
+
+    def tearDown(self):
+        """Tearing down"""
+        entree.utils.CONFIG_FILE_NAME = self.cfile
+        entree.utils.CONFIG_DIR = self.cdir
+
+
 class TestProjectPaths(unittest.TestCase):
     """Testing if the template path, the single-file path
     files path exists
@@ -313,5 +501,15 @@ class TestProjectPaths(unittest.TestCase):
                 self.assertTrue(os.path.exists(project_cls.single_file_path()))
 
 
+class TestProjectClasses(unittest.TestCase):
+    """Testing the project class lookups"""
+
+    def test_classes_by_long_name(self):
+        """Testing that each long name maps to its project class"""
+        self.assertEqual(sorted(CLASSES_BY_LONG_NAME), CLASS_LONG_NAMES)
+        for project_cls in CLASSES:
+            self.assertIs(CLASSES_BY_LONG_NAME[project_cls.project_long_name], project_cls)
+
+
 if __name__ == "__main__":
     unittest.main()
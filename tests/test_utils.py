@@ -5,13 +5,19 @@
 Tests for entree
 """
 
+import copy
 import datetime
+import fnmatch
+import json
 import os
 import shutil
 import unittest
+import zipfile
 
 from jinja2.exceptions import UndefinedError
 import entree
+import entree.generation
+import entree.templatepack
 from utilities import TMPFile, random_string
 
 
@@ -21,7 +27,7 @@ class TestConfig(unittest.TestCase):
     def test_get_config_dir(self):
         """Test get_config_dir()"""
         username = os.getenv("SUDO_USER") or os.getenv("USER")
-        homedir = os.path.expanduser("~" + username)
+        homedir = os.path.expanduser("~" + username if username else "~")
         configdir = os.path.join(homedir, ".config")
         self.assertEqual(configdir, entree.utils.get_config_dir())
 
@@ -140,6 +146,81 @@ class TestConfig(unittest.TestCase):
             entree.utils.set_config(**old_config)
 
 
+class TestConfigCache(unittest.TestCase):
+    """Testing the config cache"""
+
+    def setUp(self):
+        """Use a temporary config directory"""
+        self.cdir = entree.utils.CONFIG_DIR
+        self.tmpdir = TMPFile()
+        entree.utils.CONFIG_DIR = self.tmpdir.__enter__()
+        entree.utils.set_config(author="Lily")
+
+    def test_read_config_cache(self):
+        """Test that the config file is parsed once until it changes"""
+        misses = entree.utils._CONFIG_CACHE.misses
+        config = entree.utils.read_config()
+        self.assertEqual(config["author"], "Lily")
+        config["author"] = "Bob"
+        self.assertEqual(entree.utils.read_config()["author"], "Lily")
+        self.assertEqual(entree.utils.get_config_param("author"), "Lily")
+        self.assertEqual(entree.utils._CONFIG_CACHE.misses, misses + 1)
+
+        with open(entree.utils.get_config_file(), "w") as fil:
+            json.dump({"author": "Bob Dylan"}, fil)
+        self.assertEqual(entree.utils.get_config_param("author"), "Bob Dylan")
+
+    def test_set_config(self):
+        """Test that set_config() invalidates the config cache"""
+        self.assertEqual(entree.utils.get_config_param("author"), "Lily")
+        entree.utils.set_config(overwrite=True, author="Bobo")
+        self.assertEqual(entree.utils.get_config_param("author"), "Bobo")
+
+    def test_reload_config(self):
+        """Test reload_config()"""
+        entree.utils.read_config()
+        self.assertEqual(entree.utils.reload_config()["author"], "Lily")
+        self.assertEqual(entree.utils._CONFIG_CACHE.misses, 1)
+        entree.utils.read_config()
+        self.assertEqual(entree.utils._CONFIG_CACHE.hits, 1)
+
+    def tearDown(self):
+        """Restore the config directory"""
+        shutil.rmtree(entree.utils.CONFIG_DIR)
+        entree.utils.CONFIG_DIR = self.cdir
+
+
+class TestFrozenDict(unittest.TestCase):
+    """Testing immutable configurations"""
+
+    def test_freeze(self):
+        """Test freeze()"""
+        config = {"a": [1, {"b": 2}], "c": {"d": ["e"]}}
+        frozen = entree.utils.freeze(config)
+        self.assertEqual(frozen, {"a": (1, {"b": 2}), "c": {"d": ("e",)}})
+        self.assertIsInstance(frozen["c"], entree.utils.FrozenDict)
+        self.assertEqual(hash(frozen), hash(entree.utils.freeze(config)))
+        self.assertEqual(json.loads(json.dumps(frozen)), config)
+        self.assertEqual({frozen: 1}[entree.utils.freeze(config)], 1)
+
+    def test_immutable(self):
+        """Test that FrozenDict objects cannot be modified"""
+        frozen = entree.utils.FrozenDict(a=1)
+        for method, args in [
+            ("__setitem__", ("a", 2)),
+            ("__delitem__", ("a",)),
+            ("clear", ()),
+            ("pop", ("a",)),
+            ("popitem", ()),
+            ("setdefault", ("b", 2)),
+            ("update", ({"b": 2},)),
+        ]:
+            with self.assertRaises(TypeError):
+                getattr(frozen, method)(*args)
+        self.assertEqual(frozen, {"a": 1})
+        self.assertIs(copy.deepcopy(frozen), frozen)
+
+
 class TesProjectConfig(unittest.TestCase):
     """Testing project-specific configuration"""
 
@@ -216,6 +297,20 @@ class TesProjectConfig(unittest.TestCase):
             sorted(config.keys()), ["author", "author_email_prefix", "author_email_suffix", "author_url", "newfield"]
         )
 
+    def test_project_config_cache(self):
+        """Test that project configurations are computed once per config
+        file version
+        """
+        config = entree.projects.SQLAlchemy.get_config()
+        self.assertIs(entree.projects.SQLAlchemy.get_config(), config)
+        self.assertIsNot(entree.projects.FlaskLarge.get_config(), config)
+        self.assertEqual(hash(config), hash(entree.utils.freeze(entree.projects.SQLAlchemy.get_config())))
+        with self.assertRaises(TypeError):
+            config["author"] = "hhh"
+
+        entree.utils.set_config(overwrite=True, author="hhh")
+        self.assertEqual(entree.projects.SQLAlchemy.get_config()["author"], "hhh")
+
     def tearDown(self):
         """Get rid of the temporary file structure"""
         if os.path.exists(self.configfile):
@@ -283,6 +378,39 @@ class TestCreateDirsAndFiles(unittest.TestCase):
             content = entree.utils.render_template(path_a, name="Lily", blah={"age": 19}, date=date)
             self.assertEqual(content, "My name is Lily, I'm 19 years old. " "This is year 2018.")
 
+    def test_stream_template(self):
+        """Test stream_template()"""
+        chunk_size = entree.utils.WRITE_CHUNK_SIZE
+        entree.utils.WRITE_CHUNK_SIZE = 10
+        try:
+            with TMPFile() as rootdir:
+                path_a = os.path.join(rootdir, "a")
+                entree.utils.create_general_file(path_a, "{% for i in range(20) %}{{ name }}{% endfor %}")
+                chunks = list(entree.utils.stream_template(path_a, name="Lily"))
+                self.assertGreater(len(chunks), 1)
+                self.assertEqual("".join(chunks), "Lily" * 20)
+        finally:
+            entree.utils.WRITE_CHUNK_SIZE = chunk_size
+
+    def test_create_general_file_stream(self):
+        """Test create_general_file() with an iterator"""
+        with TMPFile() as rootdir:
+            path_a = os.path.join(rootdir, "a")
+            entree.utils.create_general_file(path_a, iter(["AAA", "BB"]))
+            with open(path_a) as fil:
+                self.assertEqual(fil.read(), "AAABB")
+
+    def test_create_general_file_zip_stream(self):
+        """Test create_general_file() with an iterator and a zip file"""
+        with TMPFile() as rootdir:
+            path_zip = os.path.join(rootdir, "a.zip")
+            with zipfile.ZipFile(path_zip, "w") as zipf:
+                entree.utils.create_general_file("a", iter(["AAA", "BB"]), zipf=zipf)
+                entree.utils.create_general_file("b", "CC", zipf=zipf)
+            with zipfile.ZipFile(path_zip) as zipf:
+                self.assertEqual(zipf.read("a"), b"AAABB")
+                self.assertEqual(zipf.read("b"), b"CC")
+
     def test_create_single_file(self):
         """Test create_single_file()"""
         with TMPFile() as rootdir:
@@ -305,6 +433,485 @@ class TestCreateDirsAndFiles(unittest.TestCase):
             entree.utils.create_single_file(path_a, "", "")
 
 
+class TestStagedBuilds(unittest.TestCase):
+    """Testing staged directories and durability options"""
+
+    def test_create_general_file_exists(self):
+        """Test that create_general_file() does not overwrite files"""
+        with TMPFile() as rootdir:
+            path_a = os.path.join(rootdir, "a")
+            entree.utils.create_general_file(path_a, "AAAAA", fsync=True)
+            with self.assertRaises(IOError):
+                entree.utils.create_general_file(path_a, "BBBBB")
+            with open(path_a) as fil:
+                self.assertEqual(fil.read(), "AAAAA")
+
+    def test_staged_directory(self):
+        """Test that staged directories appear once complete"""
+        with TMPFile() as rootdir:
+            path_a = os.path.join(rootdir, "a")
+            with entree.generation.staged_directory(path_a, fsync="build") as stagedir:
+                entree.utils.create_general_file(os.path.join(stagedir, "b"), "BBBBB")
+                self.assertFalse(os.path.exists(path_a))
+            self.assertEqual(os.listdir(rootdir), ["a"])
+            with open(os.path.join(path_a, "b")) as fil:
+                self.assertEqual(fil.read(), "BBBBB")
+            with self.assertRaises(IOError):
+                with entree.generation.staged_directory(path_a):
+                    pass
+
+    def test_staged_directory_failure(self):
+        """Test that failed builds leave nothing behind"""
+        with TMPFile() as rootdir:
+            path_a = os.path.join(rootdir, "a")
+            os.makedirs(path_a)
+            with self.assertRaises(ValueError):
+                with entree.generation.staged_directory(path_a) as stagedir:
+                    entree.utils.create_general_file(os.path.join(stagedir, "b"), "BBBBB")
+                    raise ValueError
+            self.assertEqual(os.listdir(rootdir), ["a"])
+            self.assertEqual(os.listdir(path_a), [])
+
+    def test_sync_tree(self):
+        """Test that the "build" policy flushes the staged files and
+        directories and the parent directory only
+        """
+        sync_directory = entree.generation.sync_directory
+        fsync = os.fsync
+        synced_dirs = []
+        synced_files = []
+
+        def record_fsync(fd):
+            synced_files.append(fd)
+            fsync(fd)
+
+        def fail_sync():
+            raise AssertionError("os.sync() flushes every filesystem")
+
+        def record_sync_directory(path):
+            synced_dirs.append(os.path.basename(path))
+            sync_directory(path)
+
+        entree.generation.sync_directory = record_sync_directory
+        os.fsync = record_fsync
+        sync = getattr(os, "sync", None)
+        os.sync = fail_sync
+        try:
+            with TMPFile() as rootdir:
+                path_a = os.path.join(rootdir, "a")
+                with entree.generation.staged_directory(path_a, fsync="build") as stagedir:
+                    os.makedirs(os.path.join(stagedir, "c"))
+                    entree.utils.create_general_file(os.path.join(stagedir, "b"), "BBBBB")
+                    entree.utils.create_general_file(os.path.join(stagedir, "c", "d"), "DDDDD")
+                # Two files, then the directories
+                self.assertEqual(len(synced_dirs), 3)
+                self.assertEqual(len(synced_files), 2 + len(synced_dirs))
+                self.assertEqual(synced_dirs[1:], ["c", rootdir])
+        finally:
+            entree.generation.sync_directory = sync_directory
+            os.fsync = fsync
+            if sync is None:
+                del os.sync
+            else:
+                os.sync = sync
+
+    def test_fsync_policy(self):
+        """Test get_fsync_policy()"""
+        for policy in entree.generation.FSYNC_POLICIES:
+            self.assertEqual(entree.generation.get_fsync_policy(policy), policy)
+        with self.assertRaises(ValueError):
+            entree.generation.get_fsync_policy("always")
+
+
+class TestTemplateCache(unittest.TestCase):
+    """Testing the compiled template cache"""
+
+    def setUp(self):
+        """Start from an empty cache"""
+        entree.utils.clear_template_cache()
+
+    def test_cache_hit(self):
+        """Test that a template is compiled only once"""
+        with TMPFile() as rootdir:
+            path_a = os.path.join(rootdir, "a")
+            entree.utils.create_general_file(path_a, "Hello {{ name }}")
+            template = entree.utils.get_template(path_a)
+            self.assertIs(entree.utils.get_template(path_a), template)
+            self.assertEqual(entree.utils.render_template(path_a, name="Lily"), "Hello Lily")
+
+    def test_cache_invalidation(self):
+        """Test that a modified template is recompiled"""
+        with TMPFile() as rootdir:
+            path_a = os.path.join(rootdir, "a")
+            entree.utils.create_general_file(path_a, "Hello {{ name }}")
+            self.assertEqual(entree.utils.render_template(path_a, name="Lily"), "Hello Lily")
+            os.remove(path_a)
+            entree.utils.create_general_file(path_a, "Goodbye {{ name }}")
+            self.assertEqual(entree.utils.render_template(path_a, name="Lily"), "Goodbye Lily")
+
+    def test_lru_bound(self):
+        """Test that the cache never grows beyond its maximum size"""
+        cache = entree.utils.LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_lru_stamp(self):
+        """Test that an entry with a different stamp is a miss"""
+        cache = entree.utils.LRUCache(maxsize=2)
+        cache.put("a", 1, stamp=(1, 2))
+        self.assertEqual(cache.get("a", (1, 2)), 1)
+        self.assertIsNone(cache.get("a", (1, 3)))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_bytes(self):
+        """Test that the cache never holds more than `maxbytes`"""
+        cache = entree.utils.LRUCache(maxsize=10, maxbytes=10)
+        cache.put("a", "aaaa", size=4)
+        cache.put("b", "bbbb", size=4)
+        cache.put("a", "aaaaa", size=5)
+        self.assertEqual(cache.nbytes, 9)
+        cache.put("c", "cc", size=2)
+        self.assertEqual(cache.nbytes, 7)
+        self.assertIsNone(cache.get("b"))
+        cache.put("d", "d" * 11, size=11)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.get("a"), "aaaaa")
+        cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_lru_name(self):
+        """Test that named caches are listed for statistics"""
+        self.assertIs(entree.utils.CACHES["template"], entree.utils._TEMPLATE_CACHE)
+        name = random_string(16)
+        cache = entree.utils.LRUCache(maxsize=2, name=name)
+        try:
+            self.assertIs(entree.utils.CACHES[name], cache)
+        finally:
+            del entree.utils.CACHES[name]
+
+
+class TestBytecodeCache(unittest.TestCase):
+    """Testing the on-disk bytecode cache"""
+
+    def setUp(self):
+        """Use a temporary cache directory"""
+        self.cachedir = entree.utils.CACHE_DIR
+        self.tmpdir = random_string(16)
+        entree.utils.CACHE_DIR = self.tmpdir
+        entree.utils.clear_template_cache()
+
+    def test_get_cache_dir(self):
+        """Test get_cache_dir()"""
+        self.assertEqual(entree.utils.get_cache_dir(), self.tmpdir)
+
+    def test_bytecode_cache(self):
+        """Test that compiled templates are stored in the cache directory
+        and reused after the in-memory cache is emptied
+        """
+        with TMPFile() as rootdir:
+            path_a = os.path.join(rootdir, "a")
+            entree.utils.create_general_file(path_a, "Hello {{ name }}")
+            self.assertEqual(entree.utils.render_template(path_a, name="Lily"), "Hello Lily")
+            self.assertEqual(len(os.listdir(self.tmpdir)), 1)
+            entree.utils.clear_template_cache()
+            self.assertEqual(entree.utils.render_template(path_a, name="Lily"), "Hello Lily")
+            self.assertEqual(len(os.listdir(self.tmpdir)), 1)
+
+    def test_no_user(self):
+        """Test that templates are rendered when USER is unset or the cache
+        directory cannot be found
+        """
+        environ = dict(os.environ)
+        cache_dir = entree.utils.get_cache_dir
+        try:
+            for name in ["USER", "SUDO_USER"]:
+                os.environ.pop(name, None)
+            os.environ["XDG_CACHE_HOME"] = self.tmpdir
+            entree.utils.CACHE_DIR = ""
+            self.assertEqual(entree.utils.get_home_dir(), os.path.expanduser("~"))
+            self.assertEqual(entree.utils.get_cache_dir(), os.path.join(self.tmpdir, "entree"))
+
+            def broken_cache_dir():
+                raise TypeError("no home directory")
+
+            entree.utils.get_cache_dir = broken_cache_dir
+            entree.utils.clear_template_cache()
+            with TMPFile() as rootdir:
+                path_a = os.path.join(rootdir, "a")
+                entree.utils.create_general_file(path_a, "Hello {{ name }}")
+                self.assertEqual(entree.utils.render_template(path_a, name="Lily"), "Hello Lily")
+        finally:
+            entree.utils.get_cache_dir = cache_dir
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def tearDown(self):
+        """Remove the temporary cache directory"""
+        entree.utils.CACHE_DIR = self.cachedir
+        entree.utils.clear_template_cache()
+        if os.path.exists(self.tmpdir):
+            shutil.rmtree(self.tmpdir)
+
+
+class TestTemplatePack(unittest.TestCase):
+    """Testing the precompiled template pack"""
+
+    def setUp(self):
+        """Create a fake template directory and its template pack"""
+        self.pack = entree.utils.TEMPLATE_PACK
+        self.pack_root = entree.utils.TEMPLATE_PACK_ROOT
+        self.template_dir = os.path.abspath(random_string(16))
+        os.makedirs(self.template_dir)
+        self.file_a = os.path.join(self.template_dir, "a.txt")
+        entree.utils.create_general_file(self.file_a, "Hello {{ name }}")
+        entree.utils.TEMPLATE_PACK = os.path.join(self.template_dir, "templates.zip")
+        entree.utils.TEMPLATE_PACK_ROOT = self.template_dir
+        entree.utils.clear_template_cache()
+
+    def test_build_template_pack(self):
+        """Test build_template_pack()"""
+        names = entree.templatepack.build_template_pack(entree.utils.TEMPLATE_PACK, self.template_dir)
+        self.assertListEqual(names, ["a.txt"])
+
+    def test_packed_template(self):
+        """Test that templates are loaded from the pack unless they changed"""
+        entree.templatepack.build_template_pack(entree.utils.TEMPLATE_PACK, self.template_dir)
+        self.assertIsNotNone(entree.utils._load_packed_template(self.file_a))
+        self.assertEqual(entree.utils.render_template(self.file_a, name="Lily"), "Hello Lily")
+
+        # Same size, different content: the template is compiled from source
+        os.remove(self.file_a)
+        entree.utils.create_general_file(self.file_a, "Howdy {{ name }}")
+        self.assertIsNone(entree.utils._load_packed_template(self.file_a))
+        self.assertEqual(entree.utils.render_template(self.file_a, name="Lily"), "Howdy Lily")
+
+    def test_no_template_pack(self):
+        """Test that templates are loaded from source without a pack"""
+        self.assertEqual(entree.utils.render_template(self.file_a, name="Lily"), "Hello Lily")
+
+    def tearDown(self):
+        """Get rid of the temporary file structure"""
+        entree.utils.TEMPLATE_PACK = self.pack
+        entree.utils.TEMPLATE_PACK_ROOT = self.pack_root
+        entree.utils.clear_template_cache()
+        if os.path.exists(self.template_dir):
+            shutil.rmtree(self.template_dir)
+
+
+class TestVerbatimFiles(unittest.TestCase):
+    """Testing the verbatim copy of files without Jinja syntax"""
+
+    def setUp(self):
+        """Create a few template files"""
+        self.template_dir = random_string(16)
+        os.makedirs(self.template_dir)
+        self.contents = {
+            "plain.txt": b"body { color: red; }\n",
+            "nonewline.txt": b"no newline",
+            "crlf.txt": b"line1\r\nline2\r\n",
+            "jinja.txt": b"{{ name }}\n",
+            "comment.txt": b"{# comment #}text\n",
+            "empty.txt": b"",
+        }
+        for name, content in self.contents.items():
+            with open(os.path.join(self.template_dir, name), "wb") as fil:
+                fil.write(content)
+
+    def test_get_verbatim_length(self):
+        """Test get_verbatim_length()"""
+        expected = {
+            "plain.txt": len(self.contents["plain.txt"]) - 1,
+            "nonewline.txt": len(self.contents["nonewline.txt"]),
+            "crlf.txt": None,
+            "jinja.txt": None,
+            "comment.txt": None,
+            "empty.txt": 0,
+        }
+        for name, length in expected.items():
+            path = os.path.join(self.template_dir, name)
+            self.assertEqual(entree.utils.get_verbatim_length(path), length)
+
+    def test_verbatim_matches_rendering(self):
+        """Test that copied files are identical to rendered files"""
+        with TMPFile() as rootdir:
+            entree.utils.copy_file_structure(rootdir, self.template_dir, name="Lily")
+            for name in self.contents:
+                with open(os.path.join(rootdir, name), "rb") as fil:
+                    content = fil.read()
+                rendered = entree.utils.render_template(os.path.join(self.template_dir, name), name="Lily")
+                self.assertEqual(content, rendered.encode("utf-8"))
+
+    def test_verbatim_zip(self):
+        """Test that copied files are identical to rendered files in a zip"""
+        with TMPFile() as rootdir:
+            path_zip = os.path.join(rootdir, "a.zip")
+            with zipfile.ZipFile(path_zip, "w") as zipf:
+                entree.utils.copy_file_structure("", self.template_dir, zipf=zipf, name="Lily")
+            with zipfile.ZipFile(path_zip) as zipf:
+                for name in self.contents:
+                    rendered = entree.utils.render_template(os.path.join(self.template_dir, name), name="Lily")
+                    self.assertEqual(zipf.read(name), rendered.encode("utf-8"))
+
+    def tearDown(self):
+        """Get rid of the temporary file structure"""
+        if os.path.exists(self.template_dir):
+            shutil.rmtree(self.template_dir)
+
+
+class TestBinaryFiles(unittest.TestCase):
+    """Testing the copy of binary template files"""
+
+    def setUp(self):
+        """Create a few binary template files"""
+        self.template_dir = random_string(16)
+        os.makedirs(os.path.join(self.template_dir, "static"))
+        self.contents = {
+            "favicon.ico": b"{{ not a template }}\n",
+            "static/data.bin": bytes(range(256)) * 64,
+            "static/latin1.txt": "caf\xe9 {{ name }}".encode("latin-1"),
+        }
+        for name, content in self.contents.items():
+            with open(os.path.join(self.template_dir, name), "wb") as fil:
+                fil.write(content)
+
+    def test_get_verbatim_length(self):
+        """Test get_verbatim_length() with binary files"""
+        for name, content in self.contents.items():
+            path = os.path.join(self.template_dir, name)
+            self.assertEqual(entree.utils.get_verbatim_length(path), len(content))
+
+    def test_binary_copy(self):
+        """Test that binary files are copied unchanged"""
+        with TMPFile() as rootdir:
+            entree.utils.copy_file_structure(rootdir, self.template_dir, name="Lily")
+            for name, content in self.contents.items():
+                with open(os.path.join(rootdir, name), "rb") as fil:
+                    self.assertEqual(fil.read(), content)
+
+    def test_binary_zip(self):
+        """Test that binary files are copied unchanged in a zip"""
+        with TMPFile() as rootdir:
+            path_zip = os.path.join(rootdir, "a.zip")
+            with zipfile.ZipFile(path_zip, "w") as zipf:
+                entree.utils.copy_file_structure("", self.template_dir, zipf=zipf, name="Lily")
+            with zipfile.ZipFile(path_zip) as zipf:
+                for name, content in self.contents.items():
+                    self.assertEqual(zipf.read(name), content)
+
+    def test_link_modes(self):
+        """Test that binary files are materialized identically whatever the
+        link mode
+        """
+        for link_mode in entree.generation.LINK_MODES:
+            with TMPFile() as rootdir:
+                entree.utils.copy_file_structure(rootdir, self.template_dir, link_mode=link_mode, name="Lily")
+                for name, content in self.contents.items():
+                    with open(os.path.join(rootdir, name), "rb") as fil:
+                        self.assertEqual(fil.read(), content)
+                with self.assertRaises(IOError):
+                    entree.utils.copy_file_structure(rootdir, self.template_dir, link_mode=link_mode, name="Lily")
+
+    def test_hardlink(self):
+        """Test that hard-linked files share the template file"""
+        with TMPFile() as rootdir:
+            entree.utils.copy_file_structure(rootdir, self.template_dir, link_mode="hardlink", name="Lily")
+            for name in self.contents:
+                template_stat = os.stat(os.path.join(self.template_dir, name))
+                self.assertEqual(os.stat(os.path.join(rootdir, name)).st_ino, template_stat.st_ino)
+
+    def test_get_link_mode(self):
+        """Test get_link_mode()"""
+        for link_mode in entree.generation.LINK_MODES:
+            self.assertEqual(entree.generation.get_link_mode(link_mode), link_mode)
+        with self.assertRaises(ValueError):
+            entree.generation.get_link_mode("symlink")
+
+    def tearDown(self):
+        """Get rid of the temporary file structure"""
+        if os.path.exists(self.template_dir):
+            shutil.rmtree(self.template_dir)
+
+
+class TestTemplateManifest(unittest.TestCase):
+    """Testing the template manifest"""
+
+    def setUp(self):
+        """Create a fake template root directory and its manifest"""
+        self.manifest = entree.utils.TEMPLATE_MANIFEST
+        self.pack_root = entree.utils.TEMPLATE_PACK_ROOT
+        self.template_root = os.path.abspath(random_string(16))
+        self.project_dir = os.path.join(self.template_root, "project")
+        os.makedirs(os.path.join(self.project_dir, "src"))
+        entree.utils.create_general_file(os.path.join(self.project_dir, "a.txt"), "plain")
+        entree.utils.create_general_file(os.path.join(self.project_dir, "src", "b_py.template"), "{{ name }}")
+        entree.utils.TEMPLATE_MANIFEST = os.path.join(self.template_root, "manifest.json")
+        entree.utils.TEMPLATE_PACK_ROOT = self.template_root
+        entree.utils.clear_template_cache()
+
+    def test_build_template_manifest(self):
+        """Test build_template_manifest()"""
+        manifest = entree.templatepack.build_template_manifest(entree.utils.TEMPLATE_MANIFEST, self.template_root)
+        entries = {entry["path"]: entry for entry in manifest["projects"]["project"]}
+        self.assertListEqual(sorted(entries), ["a.txt", "src", "src/b_py.template"])
+        self.assertTrue(entries["src"]["dir"])
+        self.assertFalse(entries["a.txt"]["jinja"])
+        self.assertEqual(entries["a.txt"]["length"], 5)
+        self.assertTrue(entries["src/b_py.template"]["jinja"])
+        self.assertEqual(entries["src/b_py.template"]["size"], 10)
+
+    def test_manifest_walk(self):
+        """Test that template directories are read from the manifest"""
+        entree.templatepack.build_template_manifest(entree.utils.TEMPLATE_MANIFEST, self.template_root)
+        expected = entree.utils.get_all_dirs_and_files(self.project_dir, files_to_ignore=[])
+        # Files are listed even when they are not on disk anymore
+        shutil.rmtree(os.path.join(self.project_dir, "src"))
+        self.assertEqual(entree.utils.get_all_dirs_and_files(self.project_dir, files_to_ignore=[]), expected)
+        dirs, files = entree.utils.get_all_dirs_and_files(self.project_dir, files_to_ignore=["src"])
+        self.assertListEqual(dirs, [])
+        self.assertListEqual(files, ["a.txt"])
+
+    def test_manifest_verbatim_length(self):
+        """Test that verbatim lengths are read from the manifest unless the
+        template changed
+        """
+        file_a = os.path.join(self.project_dir, "a.txt")
+        entree.templatepack.build_template_manifest(entree.utils.TEMPLATE_MANIFEST, self.template_root)
+        self.assertEqual(entree.utils.get_verbatim_length(file_a), 5)
+
+        # Same size, with Jinja syntax: the file is rendered
+        os.remove(file_a)
+        entree.utils.create_general_file(file_a, "{{a}}")
+        self.assertIsNone(entree.utils.get_verbatim_length(file_a))
+        self.assertEqual(entree.utils.render_template(file_a, a="plain"), "plain")
+
+        # Longer file without Jinja syntax: the file is copied in full
+        os.remove(file_a)
+        entree.utils.create_general_file(file_a, "plain text")
+        self.assertEqual(entree.utils.get_verbatim_length(file_a), 10)
+        self.assertEqual(entree.utils.get_template_digest(file_a), entree.utils.hash_file(file_a))
+
+    def test_no_manifest(self):
+        """Test that template directories are walked without a manifest"""
+        self.assertIsNone(entree.utils.get_manifest_entries(self.project_dir))
+        dirs, files = entree.utils.get_all_dirs_and_files(self.project_dir, files_to_ignore=[])
+        self.assertListEqual(dirs, ["src"])
+        self.assertListEqual(files, ["a.txt", os.path.join("src", "b_py.template")])
+
+    def tearDown(self):
+        """Get rid of the temporary file structure"""
+        entree.utils.TEMPLATE_MANIFEST = self.manifest
+        entree.utils.TEMPLATE_PACK_ROOT = self.pack_root
+        entree.utils.clear_template_cache()
+        if os.path.exists(self.template_root):
+            shutil.rmtree(self.template_root)
+
+
 class TestReplaceDirname(unittest.TestCase):
     """Testing entree.utils.replace_pathname"""
 
@@ -531,6 +1138,44 @@ class TestGetAllDirsAndFiles(unittest.TestCase):
         self.assertEqual(files, sorted(flfiles))
 
 
+class TestIgnoreMatcher(unittest.TestCase):
+    """Testing entree.generation.IgnoreMatcher"""
+
+    def test_matches_fnmatch(self):
+        """Testing that the compiled matcher agrees with fnmatch"""
+        patterns = [".DS_Store", "*.md", "req*", "src/*", "tests", "a?c.[ch]"]
+        paths = [
+            ".DS_Store",
+            "src/.DS_Store",
+            "README.md",
+            "docs/README.md",
+            "requirements.txt",
+            "src",
+            "src/__init___py.template",
+            "tests",
+            "tests/unittest_py.template",
+            "abc.c",
+            "abc.py",
+            "setup_py.template",
+        ]
+        matcher = entree.generation.IgnoreMatcher(patterns)
+        for path in paths:
+            name = os.path.basename(path)
+            expected = any(fnmatch.fnmatch(name, pat) or fnmatch.fnmatch(path, pat) for pat in patterns)
+            self.assertEqual(matcher.matches(name, path), expected)
+
+    def test_empty(self):
+        """Testing a matcher without patterns"""
+        matcher = entree.generation.IgnoreMatcher([])
+        self.assertFalse(matcher.matches("a", "a"))
+
+    def test_get_ignore_matcher(self):
+        """Testing that matchers are compiled once"""
+        matcher = entree.generation.get_ignore_matcher([".DS_Store", "*.md"])
+        self.assertIs(entree.generation.get_ignore_matcher([".DS_Store", "*.md"]), matcher)
+        self.assertIs(entree.generation.get_ignore_matcher(matcher), matcher)
+
+
 class TestCopyFileStructure(unittest.TestCase):
     """Testing copy_file_structure"""
 
@@ -611,6 +1256,17 @@ class TestCopyFileStructure(unittest.TestCase):
                 content = fil.read()
                 self.assertEqual(content, "I'm 19 years old.")
 
+    def test_cfs_stream(self):
+        """Test copy_file_structure() in streaming mode"""
+        with TMPFile() as rootdir:
+            file_b = os.path.join(rootdir, "b", "b.md")
+            file_c = os.path.join(rootdir, "c", "c.py")
+            entree.utils.copy_file_structure(rootdir, self.template_dir, stream=True, blah={"age": 19}, name="Lily")
+            with open(file_b) as fil:
+                self.assertEqual(fil.read(), "Lily")
+            with open(file_c) as fil:
+                self.assertEqual(fil.read(), "I'm 19 years old.")
+
     def test_cfs_with_replace(self):
         """Test copy_file_structure()"""
         with TMPFile() as rootdir:
@@ -721,6 +1377,45 @@ class TestCopyFileStructure(unittest.TestCase):
                 content = fil.read()
                 self.assertEqual(content, "My name is")
 
+    def test_cfs_partial_glob(self):
+        """Test copy_file_structure() with glob patterns"""
+        with TMPFile() as rootdir:
+            file_a = os.path.join(rootdir, "a", "a.txt")
+            file_b = os.path.join(rootdir, "b", "b.md")
+            file_c = os.path.join(rootdir, "c", "c.py")
+            partial = ["a", "c", "*/*.txt", "c/*"]
+            partial = [os.path.join(self.template_dir, name) for name in partial]
+            entree.utils.copy_file_structure(rootdir, self.template_dir, partial=partial, blah={"age": 19})
+            self.assertTrue(os.path.exists(file_a))
+            self.assertFalse(os.path.exists(file_b))
+            self.assertTrue(os.path.exists(file_c))
+
+    def test_partial_selection(self):
+        """Test entree.generation.PartialSelection"""
+        partial = ["a", "a/a.txt", "c", "c/d/*.py"]
+        partial = [os.path.join(self.template_dir, name) for name in partial]
+        selection = entree.generation.PartialSelection(partial, self.template_dir)
+        self.assertTrue(selection.includes("a"))
+        self.assertTrue(selection.includes(os.path.join("a", "a.txt")))
+        self.assertTrue(selection.includes(os.path.join("c", "d", "e.py")))
+        self.assertFalse(selection.includes("b"))
+        self.assertFalse(selection.includes(os.path.join("c", "d")))
+        self.assertTrue(selection.may_contain("a"))
+        self.assertTrue(selection.may_contain("c"))
+        self.assertTrue(selection.may_contain(os.path.join("c", "d")))
+        self.assertFalse(selection.may_contain("b"))
+        self.assertFalse(selection.may_contain(os.path.join("a", "b")))
+
+    def test_cfs_partial_pruning(self):
+        """Test that copy_file_structure() does not list directories
+        without selected content
+        """
+        partial = [os.path.join(self.template_dir, name) for name in ["a", "a/a.txt", "c"]]
+        selection = entree.generation.PartialSelection(partial, self.template_dir)
+        plan = entree.generation.plan_file_structure(self.template_dir, partial=selection)
+        self.assertEqual(sorted(op.src for op in plan), sorted([self.path_a, self.file_a, self.path_c]))
+        self.assertFalse(selection.may_contain("c"))
+
     def test_cfs_ignore(self):
         """Test copy_file_structure()"""
         with TMPFile() as rootdir:
@@ -793,6 +1488,145 @@ class TestCopyFileStructure(unittest.TestCase):
             self.assertTrue(os.path.exists(file_b))
             self.assertTrue(os.path.exists(file_c))
 
+    def test_walk_template_tree(self):
+        """Test walk_template_tree()"""
+        entries = list(entree.generation.walk_template_tree(self.template_dir))
+        self.assertListEqual(
+            [(entry.relpath, entry.is_dir) for entry in entries],
+            [
+                ("a", True),
+                ("b", True),
+                ("c", True),
+                (os.path.join("a", "a.txt"), False),
+                (os.path.join("b", "b.md"), False),
+                (os.path.join("c", "c_py.template"), False),
+            ],
+        )
+        self.assertEqual(entries[3].src, self.file_a)
+
+    def test_walk_template_tree_pruning(self):
+        """Test that walk_template_tree() does not list ignored or excluded
+        directories
+        """
+        listed = []
+
+        def include(src, relpath):
+            listed.append(relpath)
+            return relpath != "b"
+
+        entries = list(entree.generation.walk_template_tree(self.template_dir, files_to_ignore=["c"], include=include))
+        self.assertListEqual([entry.relpath for entry in entries], ["a", os.path.join("a", "a.txt")])
+        self.assertNotIn(os.path.join("b", "b.md"), listed)
+        self.assertNotIn(os.path.join("c", "c_py.template"), listed)
+
+    def test_plan_file_structure(self):
+        """Test plan_file_structure()"""
+        plan = entree.generation.plan_file_structure(self.template_dir, replace={"c": "{{ name }}"})
+        operations = {op.src: op for op in plan}
+        self.assertEqual(len(plan), 6)
+        self.assertEqual(operations[self.path_a].action, "mkdir")
+        self.assertEqual(operations[self.file_a].action, "copy")
+        self.assertEqual(operations[self.file_b].action, "render")
+        self.assertEqual(operations[self.file_c].name, "c.py")
+        self.assertTrue(operations[self.path_c].templated)
+        self.assertEqual(plan[operations[self.file_c].parent].src, self.path_c)
+        for index, operation in enumerate(plan):
+            self.assertLess(operation.parent, index)
+
+    def test_execute_plan(self):
+        """Test that a plan can be executed several times"""
+        plan = entree.generation.plan_file_structure(self.template_dir, replace={"c": "{{ name }}"})
+        for name in ["Lily", "Bob"]:
+            with TMPFile() as rootdir:
+                entree.generation.execute_plan(rootdir, plan, blah={"age": 19}, name=name)
+                with open(os.path.join(rootdir, "b", "b.md")) as fil:
+                    self.assertEqual(fil.read(), name)
+                with open(os.path.join(rootdir, name, "c.py")) as fil:
+                    self.assertEqual(fil.read(), "I'm 19 years old.")
+
+    def test_iter_build(self):
+        """Test that builds can be generated one file at a time"""
+        operations = entree.generation.iter_file_structure(self.template_dir, replace={"c": "{{ name }}"})
+        self.assertEqual(next(operations).action, "mkdir")
+        plan = entree.generation.plan_file_structure(self.template_dir, replace={"c": "{{ name }}"})
+        for stream in [False, True]:
+            items = {}
+            build = entree.generation.iter_build(plan, stream=stream, blah={"age": 19}, name="Lily")
+            for relpath, kind, payload in build:
+                if kind == "file" and stream:
+                    payload = "".join(payload)
+                items[relpath] = (kind, payload)
+            self.assertEqual(items["a"], ("dir", None))
+            self.assertEqual(items[os.path.join("b", "b.md")], ("file", "Lily"))
+            self.assertEqual(items[os.path.join("Lily", "c.py")], ("file", "I'm 19 years old."))
+            self.assertEqual(items[os.path.join("a", "a.txt")], ("copy", (self.file_a, len("My name is"))))
+
+    def test_manifest_outputs(self):
+        """Test that the recorded output hashes match the files written,
+        without reading them back
+        """
+        with open(os.path.join(self.template_dir, "d.txt"), "w") as fil:
+            fil.write("Trailing newline\n")
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        hash_file = entree.utils.hash_file
+        with TMPFile() as rootdir:
+            manifest = entree.generation.read_generation_manifest(rootdir)
+            hashed = []
+
+            def record_hash(filename, length=None):
+                hashed.append(os.path.abspath(filename))
+                return hash_file(filename, length)
+
+            entree.utils.hash_file = entree.generation.hash_file = record_hash
+            try:
+                for stream in [False, True]:
+                    entree.generation.execute_plan(
+                        rootdir, plan, manifest=manifest, stream=stream, blah={"age": 19}, name="Lily"
+                    )
+                    self.assertFalse([path for path in hashed if path.startswith(os.path.abspath(rootdir))])
+                    for relpath, record in manifest["files"].items():
+                        self.assertEqual(record["output"], hash_file(os.path.join(rootdir, relpath)))
+                    shutil.rmtree(rootdir)
+                    os.makedirs(rootdir)
+            finally:
+                entree.utils.hash_file = entree.generation.hash_file = hash_file
+
+    def test_update_plan(self):
+        """Test that updates only rewrite files whose inputs changed and
+        keep local modifications
+        """
+        plan = entree.generation.plan_file_structure(self.template_dir)
+        with TMPFile() as rootdir:
+            manifest = entree.generation.read_generation_manifest(rootdir)
+            entree.generation.execute_plan(rootdir, plan, manifest=manifest, blah={"age": 19}, name="Lily")
+            self.assertEqual(sorted(manifest["files"]), ["a/a.txt", "b/b.md", "c/c.py"])
+            entree.generation.write_generation_manifest(rootdir, manifest)
+            self.assertEqual(entree.generation.read_generation_manifest(rootdir), manifest)
+
+            # Nothing changed
+            written = entree.generation.update_plan(rootdir, plan, manifest, blah={"age": 19}, name="Lily")
+            self.assertEqual(written, [])
+
+            # Changed templates, one of them with a local modification
+            file_a = os.path.join(rootdir, "a", "a.txt")
+            file_b = os.path.join(rootdir, "b", "b.md")
+            with open(file_a, "w") as fil:
+                fil.write("Local change")
+            with open(self.file_a, "w") as fil:
+                fil.write("Your name is")
+            with open(self.file_b, "w") as fil:
+                fil.write("Hi {{ name }}")
+            written = entree.generation.update_plan(rootdir, plan, manifest, blah={"age": 19}, name="Lily")
+            self.assertEqual(written, [file_b])
+            with open(file_a) as fil:
+                self.assertEqual(fil.read(), "Local change")
+            with open(file_b) as fil:
+                self.assertEqual(fil.read(), "Hi Lily")
+
+            # Changed variables
+            written = entree.generation.update_plan(rootdir, plan, manifest, blah={"age": 20}, name="Lily")
+            self.assertEqual(written, [os.path.join(rootdir, "c", "c.py")])
+
     def tearDown(self):
         """Get rid of the temporary file structure"""
         if os.path.exists(self.template_dir):
@@ -5,14 +5,20 @@
 Test utilities for entree
 """
 
+import atexit
 import datetime
 import os
 import random
 import shutil
 import string
+import tempfile
 
 import entree.utils
 
+# Compiled templates go to a temporary directory rather than the user's cache
+entree.utils.CACHE_DIR = tempfile.mkdtemp(prefix="entree_test_cache_")
+atexit.register(shutil.rmtree, entree.utils.CACHE_DIR, True)
+
 
 def get_file_content(project, filepath, templatepath, project_cls=None):
     """Get the content of a file and of its template